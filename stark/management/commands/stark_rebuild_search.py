@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from stark.service.v1 import site
+
+
+class Command(BaseCommand):
+    help = '重建stark组件列表页面搜索使用的全文索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='数据库别名，默认为default')
+
+    def handle(self, *args, **options):
+        rebuilt = set()
+        for item in site._registry:
+            backend = item['handler'].search_backend
+            key = (type(backend), item['model_class'])
+            if key in rebuilt:
+                continue
+            rebuilt.add(key)
+            count = backend.rebuild(using=options['database'])
+            if count is None:
+                continue
+            self.stdout.write('%s.%s: %s' % (item['model_class']._meta.app_label,
+                                             item['model_class']._meta.model_name, count))
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-17 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, verbose_name='任务名称')),
+                ('handler', models.CharField(db_index=True, max_length=255, verbose_name='所属列表页面')),
+                ('status', models.IntegerField(choices=[(1, '等待执行'), (2, '执行中'), (3, '已完成'), (4, '执行失败'), (5, '已取消')], default=1, verbose_name='状态')),
+                ('progress', models.IntegerField(default=0, verbose_name='已处理条数')),
+                ('total', models.IntegerField(blank=True, null=True, verbose_name='总条数')),
+                ('checkpoint', models.CharField(blank=True, max_length=255, null=True, verbose_name='断点')),
+                ('message', models.TextField(blank=True, default='', verbose_name='执行信息')),
+                ('is_cancelled', models.BooleanField(default=False, verbose_name='是否已请求取消')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+        ),
+    ]
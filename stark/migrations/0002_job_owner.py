@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stark', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='owner',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='所属进程'),
+        ),
+    ]
@@ -1,3 +1,30 @@
 from django.db import models
 
 # Create your models here.
+
+
+class Job(models.Model):
+    """
+    后台任务表，记录在后台线程中执行的批量操作的状态、进度和断点
+    """
+    status_choices = (
+        (1, '等待执行'),
+        (2, '执行中'),
+        (3, '已完成'),
+        (4, '执行失败'),
+        (5, '已取消'),
+    )
+    name = models.CharField(verbose_name='任务名称', max_length=128)
+    handler = models.CharField(verbose_name='所属列表页面', max_length=255, db_index=True)
+    status = models.IntegerField(verbose_name='状态', choices=status_choices, default=1)
+    progress = models.IntegerField(verbose_name='已处理条数', default=0)
+    total = models.IntegerField(verbose_name='总条数', null=True, blank=True)
+    checkpoint = models.CharField(verbose_name='断点', max_length=255, null=True, blank=True)
+    message = models.TextField(verbose_name='执行信息', blank=True, default='')
+    is_cancelled = models.BooleanField(verbose_name='是否已请求取消', default=False)
+    owner = models.CharField(verbose_name='所属进程', max_length=64, blank=True, default='')
+    create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+    update_time = models.DateTimeField(verbose_name='更新时间', auto_now=True)
+
+    def __str__(self):
+        return self.name
@@ -1,15 +1,64 @@
+import asyncio
+import contextvars
+import copy
+import csv
+import hashlib
+import io
+import json
+import operator
+import tempfile
+import uuid
 from django import forms
+from django.forms.models import (ModelFormMetaclass, BaseModelFormSet, modelformset_factory,
+                                 apply_limit_choices_to_to_formfield)
 from django.conf.urls import url
 import functools
 from types import FunctionType
+from django.apps import apps
+from django.db import models
 from django.db.models import ForeignKey, ManyToManyField
 
-from django.db.models import Q
+from django.db.models import Q, F, Count, prefetch_related_objects, ProtectedError, RestrictedError
+from django.db.models.query import ValuesIterable
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.shortcuts import HttpResponse, render, redirect
+from django.template import Context
+from django.template.base import render_value_in_context
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
-from stark.utils.pagination import Pagination
-from django.http import QueryDict
+from stark.utils.pagination import Pagination, CursorPagination
+from stark.utils.cache import watch_model, make_cache_key, get_model_version, bump_model_version
+from stark.utils.count import estimate_count
+from stark.utils.bulk import bulk_delete, bulk_update
+from stark.utils.jobs import submit_job, fail_orphaned_jobs
+from stark.utils.search import SearchBackend
+from stark.utils.widgets import AutocompleteMixin, AutocompleteSelect, AutocompleteSelectMultiple
+from stark.models import Job
+from django.db import transaction, close_old_connections, connections, router, DatabaseError
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import QueryDict, StreamingHttpResponse, FileResponse, JsonResponse, HttpResponseNotModified
+from urllib.parse import quote_plus
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+_request_context = contextvars.ContextVar('stark_request', default=None)  # 当前请求，每个线程、每个异步任务互不影响
+
+
+def run_db_task(task):
+    """
+    在线程池中执行查询任务，执行前后关闭过期的数据库连接，避免线程池中的连接一直占用
+    :param task:
+    :return:
+    """
+    close_old_connections()
+    try:
+        return task()
+    finally:
+        close_old_connections()
 
 
 def get_choice_text(title, field):
@@ -27,26 +76,412 @@ def get_choice_text(title, field):
         method = "get_%s_display" % field
         return getattr(obj, method)
 
+    inner.only_fields = [field]
+    inner.choice_field = field
     return inner
 
 
-class StarkModelForm(forms.ModelForm):
+def get_annotation_text(title, name, expression):
     """
-    构造modelform的基类，目的为让每个字段在前端加上样式。
+    对于stark组建中定义列时，需要显示统计值（订单数、最后登录时间等）的列，在自己的类中调用此方法，
+    列表页面查询时通过.annotate()由数据库计算，不再每行数据查询一次；name可以写在order_list中用于排序
+    例： list_display = ['id', 'name', get_annotation_text("订单数", 'order_count', Count('order'))]
+    :param title:希望页面显示的表头
+    :param name:计算结果的名称，不能与模型的字段重名
+    :param expression:Django查询表达式，例：Count('order')、Max('order__create_time')、Subquery(...)
+    :return:
+    """
+
+    def inner(self, obj=None, is_header=None):
+        if is_header:
+            return title
+        return getattr(obj, name)
+
+    inner.only_fields = []
+    inner.annotation_name = name
+    inner.annotation = expression
+    return inner
+
+
+class ValuesRow(object):
+    """
+    开启use_values_rows时代替模型对象的轻量行对象，以属性的方式访问.values()查询到的字段值，
+    ForeignKey字段通过 字段名_id 访问关联的主键，关联对象由StarkHandler批量加载后赋值到 字段名 上。
+    """
+
+    def __init__(self, model_class, values):
+        self.__dict__.update(values)
+        self._meta = model_class._meta
+        self.pk = values.get(model_class._meta.pk.attname)
+
+    def __getattr__(self, name):
+        """
+        支持choice字段的 get_字段名_display 方法
+        :param name:
+        :return:
+        """
+        if name.startswith('get_') and name.endswith('_display'):
+            field = self._meta.get_field(name[4:-8])
+            value = self.__dict__.get(field.attname)
+            return lambda: dict(field.flatchoices).get(value, value)
+        raise AttributeError(name)
+
+
+class ValuesRowIterable(ValuesIterable):
+    """
+    将.values()查询到的每条数据直接包装为ValuesRow对象
+    """
+
+    def __iter__(self):
+        model_class = self.queryset.model
+        for values in super(ValuesRowIterable, self).__iter__():
+            yield ValuesRow(model_class, values)
+
+
+class RelatedList(list):
+    """
+    ValuesRow上多对多、反向关联的对象列表，提供与关联管理器相同的all方法
+    """
+
+    def all(self):
+        return self
+
+
+class Column(object):
+    """
+    编译后的列表页面列：key为列的标识，header为表头（每次请求重新计算），accessor为接收每行数据返回单元格内容的函数，
+    kind为列的类型：'field'普通字段，'choice'choice字段，'many'多对多字段或反向关联，'annotation'数据库计算列，'func'自定义显示函数
+    """
+
+    def __init__(self, key, header, accessor, kind='func'):
+        self.key = key
+        self.header = header
+        self.accessor = accessor
+        self.kind = kind
+
+
+class QueryRequest(object):
+    """
+    替换了GET参数的request代理对象，其余属性仍从原request获取，
+    用于按其他url参数（例如_filter中携带的列表页面参数）生成查询条件
+    """
+
+    def __init__(self, request, query_dict):
+        self._request = request
+        self.GET = query_dict
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+class Echo(object):
+    """
+    只实现write方法的伪文件对象，csv.writer写入时直接返回该行内容，用于流式导出
+    """
+
+    def write(self, value):
+        return value
+
+
+class StarkModelFormMetaclass(ModelFormMetaclass):
+    """
+    生成form类时为每个字段的插件加上样式，实例化时复制的字段已带有样式，只需给没有样式的字段补上
     """
 
-    def __init__(self, *args, **kwargs):
-        super(StarkModelForm, self).__init__(*args, **kwargs)
-        for name, field in self.fields.items():
+    def __new__(mcs, name, bases, attrs):
+        new_class = super(StarkModelFormMetaclass, mcs).__new__(mcs, name, bases, attrs)
+        for field in new_class.base_fields.values():
             field.widget.attrs['class'] = 'form-control'
+        return new_class
+
+
+class StarkModelForm(forms.ModelForm, metaclass=StarkModelFormMetaclass):
+    """
+    构造modelform的基类，目的为让每个字段在前端加上样式。
+    """
+
+    def __getitem__(self, name):
+        bound_field = super(StarkModelForm, self).__getitem__(name)
+        # 子类__init__中新增的字段、生成类之后替换的插件没有经过元类，渲染前补上样式
+        attrs = bound_field.field.widget.attrs
+        if 'class' not in attrs:
+            attrs['class'] = 'form-control'
+        return bound_field
+
+
+class ObjectChoiceField(forms.ModelChoiceField):
+    """
+    从已查询到的数据中验证主键，不再逐行查询数据库，用于行内编辑formset中每行的主键字段和外键字段
+    """
+
+    def __init__(self, object_dict, *args, **kwargs):
+        self.object_dict = object_dict
+        super(ObjectChoiceField, self).__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        obj = self.object_dict.get(str(value))
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return obj
+
+
+class SharedChoices(object):
+    """
+    行内编辑各行共用的下拉框选项，第一次渲染时才查询，整个formset每个字段只查询一次
+    """
+
+    def __init__(self, field):
+        """
+        :param field: 第一行form中的ModelChoiceField
+        """
+        self.field = field
+        self.choice_list = None
+
+    def get_choice_list(self):
+        if self.choice_list is None:
+            # 不用list()，避免ModelChoiceIterator.__len__多执行一次COUNT查询
+            self.choice_list = [choice for choice in self.field.choices]
+        return self.choice_list
+
+    def __iter__(self):
+        return iter(self.get_choice_list())
+
+    def __len__(self):
+        return len(self.get_choice_list())
+
+
+class ListEditForm(StarkModelForm):
+    """
+    行内编辑每行的form，外键字段已由ObjectChoiceField按整个formset一次查询的结果验证，
+    模型验证（full_clean）时不再逐行查询关联数据是否存在；唯一性验证不受影响
+    """
+    _skip_related_validation = True
+
+    def get_checked_related_fields(self):
+        """
+        已由ObjectChoiceField验证过的外键字段
+        :return:
+        """
+        pk_name = self._meta.model._meta.pk.name
+        return [name for name, field in self.fields.items() if isinstance(field, ObjectChoiceField) and name != pk_name]
+
+    def _get_validation_exclusions(self):
+        exclude = super(ListEditForm, self)._get_validation_exclusions()
+        if self._skip_related_validation:
+            exclude.extend(name for name in self.get_checked_related_fields() if name not in exclude)
+        return exclude
+
+    def _post_clean(self):
+        self._skip_related_validation = True
+        super(ListEditForm, self)._post_clean()
+
+    def validate_unique(self):
+        self._skip_related_validation = False
+        super(ListEditForm, self).validate_unique()
+
+
+class ListEditFormSet(BaseModelFormSet):
+    """
+    列表页面行内编辑的formset，直接使用列表页面已查询到的当前页数据；
+    提交时按提交的主键一次查询出所有要修改的数据，而不是查询整张表；
+    外键字段按所有行提交的值一次查询出关联数据，不再逐行验证
+    """
+
+    def __init__(self, *args, object_list=None, **kwargs):
+        self.object_list = object_list
+        super(ListEditFormSet, self).__init__(*args, **kwargs)
+
+    def get_queryset(self):
+        if self.object_list is None:
+            pk_list = []
+            if self.is_bound:
+                pk_name = self.model._meta.pk.name
+                for i in range(min(self.total_form_count(), self.absolute_max)):
+                    pk = self.data.get('%s-%s' % (self.add_prefix(i), pk_name))
+                    if pk:
+                        pk_list.append(pk)
+            try:
+                self.object_list = list(self.model._default_manager.filter(pk__in=pk_list))
+            except (ValueError, ValidationError):
+                self.object_list = []
+        return self.object_list
+
+    def add_fields(self, form, index):
+        super(ListEditFormSet, self).add_fields(form, index)
+        pk_name = self.model._meta.pk.name
+        field = form.fields.get(pk_name)
+        if isinstance(field, forms.ModelChoiceField):
+            if not hasattr(self, '_object_dict_by_str'):
+                self._object_dict_by_str = {str(obj.pk): obj for obj in self.get_queryset()}
+            form.fields[pk_name] = ObjectChoiceField(self._object_dict_by_str, field.queryset, initial=field.initial,
+                                                     required=False, widget=field.widget)
+        for name, field in list(form.fields.items()):
+            if name == pk_name or type(field) is not forms.ModelChoiceField:
+                continue
+            object_dict = self.get_related_object_dict(name, field) if self.is_bound else {}
+            form.fields[name] = ObjectChoiceField(object_dict, field.queryset,
+                                                  required=field.required, widget=field.widget, label=field.label,
+                                                  initial=field.initial, help_text=field.help_text,
+                                                  empty_label=field.empty_label, to_field_name=field.to_field_name)
+        for name, field in form.fields.items():
+            if name == pk_name or not isinstance(field, forms.ModelChoiceField):
+                continue
+            if isinstance(field.widget, AutocompleteSelect):
+                field.widget.object_dict = self.get_related_object_dict(name, field)
+            elif not isinstance(field.widget, AutocompleteMixin):
+                field.widget.choices = self.get_shared_choices(name, field)
+
+    def get_shared_choices(self, name, field):
+        """
+        下拉框的选项由所有行共用，不再每行渲染时各查询一次
+        :param name: 字段名
+        :param field: form中的ModelChoiceField
+        :return:
+        """
+        if not hasattr(self, '_shared_choices'):
+            self._shared_choices = {}
+        if name not in self._shared_choices:
+            self._shared_choices[name] = SharedChoices(field)
+        return self._shared_choices[name]
+
+    def get_related_object_dict(self, name, field):
+        """
+        按所有行提交的外键字段值（未提交时为每行数据当前的值）一次查询出关联数据，每个字段只查询一次
+        :param name: 字段名
+        :param field: form中的ModelChoiceField
+        :return: {提交的值: 关联数据}
+        """
+        if not hasattr(self, '_related_object_dicts'):
+            self._related_object_dicts = {}
+        if name in self._related_object_dicts:
+            return self._related_object_dicts[name]
+
+        meta = field.queryset.model._meta
+        key_field = meta.get_field(field.to_field_name) if field.to_field_name else meta.pk
+        value_list = []
+        if self.is_bound:
+            for i in range(min(self.total_form_count(), self.absolute_max)):
+                value = self.data.get('%s-%s' % (self.add_prefix(i), name))
+                if value in field.empty_values:
+                    continue
+                try:
+                    value_list.append(key_field.to_python(value))
+                except (ValueError, TypeError, ValidationError):
+                    continue
+        else:
+            attname = self.model._meta.get_field(name).attname
+            for obj in self.get_queryset():
+                value = getattr(obj, attname)
+                if value is not None:
+                    value_list.append(value)
+        object_dict = {}
+        if value_list:
+            key = field.to_field_name or 'pk'
+            for obj in field.queryset.filter(**{'%s__in' % key: value_list}):
+                object_dict[str(getattr(obj, key))] = obj
+        self._related_object_dicts[name] = object_dict
+        return object_dict
 
 
 class SearchGroupRow(object):
-    def __init__(self, queryset_or_tuple, option, title, request):
+    def __init__(self, queryset_or_tuple, option, title, request, is_item_list=False, query_dict=None):
+        """
+
+        :param queryset_or_tuple: 筛选项的queryset或choices
+        :param option: Option对象
+        :param title: 筛选行的标题
+        :param request:
+        :param is_item_list: queryset_or_tuple是否已经是(值, 文本)列表，例如从缓存中读取的筛选项
+        :param query_dict: 生成链接时使用的列表页面url参数，默认为request.GET
+        """
         self.queryset_or_tuple = queryset_or_tuple
         self.option = option
         self.title = title
         self.request = request
+        self.is_item_list = is_item_list
+        self.query_dict = request.GET if query_dict is None else query_dict
+        self.more_url = None  # 筛选项数量超过option.limit时，加载其余筛选项的url
+        self.facet_counts = None  # option.show_count为True时，每个筛选项的值对应的数据条数
+
+    def get_item_list(self):
+        """
+        获取每个筛选项的(值, 文本)
+        :return:
+        """
+        if self.is_item_list:
+            return self.queryset_or_tuple
+        return [(str(self.option.get_value(item)), self.option.get_text(item)) for item in self.queryset_or_tuple]
+
+    def load(self):
+        """
+        提前查询筛选项，使查询在视图中完成（异步视图中与其他查询并发执行），而不是在渲染模板时
+        :return:
+        """
+        if not self.is_item_list:
+            self.queryset_or_tuple = self.get_item_list()
+            self.is_item_list = True
+
+    def get_param_base(self):
+        """
+        获取当前已选中的值，以及去掉该字段后的其余url参数，其余url参数所有筛选项共用，只编码一次
+        :return: (已选中的值列表, 其余url参数)
+        """
+        origin_value_list = self.query_dict.getlist(self.option.field)
+        query_dict = self.query_dict.copy()
+        query_dict.pop(self.option.field, None)
+        return origin_value_list, query_dict.urlencode()
+
+    def iter_links(self, item_list, origin_value_list, base):
+        """
+        为每个筛选项生成(url参数, 文本, 是否选中, 值)，每个筛选项只需拼接该字段自己的参数
+        :param item_list: 筛选项(值, 文本)列表
+        :param origin_value_list: 当前已选中的值列表
+        :param base: 去掉该字段后的其余url参数
+        :return:
+        """
+        encoded_field = quote_plus(self.option.field)
+        prefix = base + '&' if base else ''
+
+        def join(value_list):
+            if not value_list:
+                return base
+            return prefix + '&'.join('%s=%s' % (encoded_field, quote_plus(value)) for value in value_list)
+
+        origin_param = join(origin_value_list) + '&' if origin_value_list else prefix
+        for value, text in item_list:
+            is_active = value in origin_value_list
+            if not self.option.is_multi:
+                param = base if is_active else '%s%s=%s' % (prefix, encoded_field, quote_plus(value))
+            elif is_active:
+                value_list = list(origin_value_list)
+                value_list.remove(value)
+                param = join(value_list)
+            else:
+                param = '%s%s=%s' % (origin_param, encoded_field, quote_plus(value))
+            yield param, text, is_active, value
+
+    def as_dict(self):
+        """
+        筛选行的数据，用于JSON接口
+        :return:
+        """
+        origin_value_list, base = self.get_param_base()
+        item_list = self.get_item_list()
+        has_more = bool(self.option.limit) and len(item_list) > self.option.limit
+        if has_more:
+            item_list = item_list[:self.option.limit]
+        items = []
+        for param, text, is_active, value in self.iter_links(item_list, origin_value_list, base):
+            item = {"value": value, "text": str(text), "url": "?%s" % param, "active": is_active}
+            if self.facet_counts is not None:
+                item["count"] = self.facet_counts.get(value, 0)
+            items.append(item)
+        return {"field": self.option.field,
+                "title": str(self.title),
+                "items": items,
+                "more_url": self.more_url if has_more else None, }
 
     def __iter__(self):
         yield '<div class="whole">'
@@ -55,47 +490,46 @@ class SearchGroupRow(object):
 
         yield '<div class="others">'
 
-        query_dict = self.request.GET.copy()
-        query_dict._mutable = True
-        origin_value_list = query_dict.getlist(self.option.field)
+        origin_value_list, base = self.get_param_base()
         if not origin_value_list:
-            yield "<a href='?%s' class='active'>全部</a>" % query_dict.urlencode()
+            yield "<a href='?%s' class='active'>全部</a>" % self.query_dict.urlencode()
         else:
-            query_dict.pop(self.option.field)
-            yield "<a href='?%s'>全部</a>" % query_dict.urlencode()
-        for item in self.queryset_or_tuple:
-            text = self.option.get_text(item)
-            value = str(self.option.get_value(item))
-            query_dict = self.request.GET.copy()
-            query_dict._mutable = True
-            if not self.option.is_multi:
-                query_dict[self.option.field] = value
-                if value in origin_value_list:
-                    query_dict.pop(self.option.field)
-                    yield "<a href='?%s' class='active'>%s</a>" % (query_dict.urlencode(), text)
-                else:
-                    yield "<a href='?%s'>%s</a>" % (query_dict.urlencode(), text)
+            yield "<a href='?%s'>全部</a>" % base
+
+        item_list = self.get_item_list()
+        has_more = bool(self.option.limit) and len(item_list) > self.option.limit
+        if has_more:
+            item_list = item_list[:self.option.limit]
+        for param, text, is_active, value in self.iter_links(item_list, origin_value_list, base):
+            if self.facet_counts is not None:
+                text = "%s<span class='count'>(%s)</span>" % (text, self.facet_counts.get(value, 0))
+            if is_active:
+                yield "<a href='?%s' class='active'>%s</a>" % (param, text)
             else:
-                mutil_value_list = query_dict.getlist(self.option.field)
-                if value in mutil_value_list:
-                    mutil_value_list.remove(value)
-                    query_dict.setlist(self.option.field, mutil_value_list)
-                    yield "<a href='?%s' class='active'>%s</a>" % (query_dict.urlencode(), text)
-                else:
-                    mutil_value_list.append(value)
-                    query_dict.setlist(self.option.field, mutil_value_list)
-                    yield "<a href='?%s'>%s</a>" % (query_dict.urlencode(), text)
+                yield "<a href='?%s'>%s</a>" % (param, text)
+        if has_more and self.more_url:
+            yield "<span class='more-options' data-url='%s' data-offset='%s'>" % (self.more_url, self.option.limit)
+            if self.option.search_list:
+                yield "<input class='more-keyword' type='text' placeholder='搜索'>"
+            yield "<a class='more-link' href='javascript:void(0);'>更多</a></span>"
 
         yield '</div>'
 
 
 class Option(object):
     """用于构建多条件筛选对象"""
-    def __init__(self, field, db_condition=None, text_func=None, value_func=None, is_multi=False):
+    def __init__(self, field, db_condition=None, text_func=None, value_func=None, is_multi=False, use_cache=False,
+                 cache_timeout=3600, limit=None, search_list=None, show_count=False):
         """
 
         :param field:组合搜索关联的字段
         :param db_condition:数据库关联查询时的条件
+        :param use_cache:是否缓存ForeignKey/多对多字段的筛选项，关联表数据新增、修改、删除时缓存自动失效；
+                         缓存按text_func、value_func函数对象区分，使用缓存时Option应定义一次（如类属性search_group）而不是每次请求重新创建
+        :param cache_timeout:筛选项的缓存时间（秒）
+        :param limit:页面上直接显示的筛选项数量，超出的筛选项点击"更多"时再分页加载，为None时全部显示
+        :param search_list:加载更多筛选项时关联表的搜索条件，例：['title__contains']
+        :param show_count:是否在每个筛选项后显示选择该项后的数据条数
         """
         self.field = field
         if not db_condition:
@@ -105,6 +539,11 @@ class Option(object):
         self.value_func = value_func
         self.is_multi = is_multi
         self.is_choice = False
+        self.use_cache = use_cache
+        self.cache_timeout = cache_timeout
+        self.limit = limit
+        self.search_list = search_list or []
+        self.show_count = show_count
 
     def get_db_condition(self, request, *args, **kwargs):
         """
@@ -129,10 +568,76 @@ class Option(object):
         title = field_object.verbose_name
         db_condition = self.get_db_condition(request, *args, **kwargs)
         if isinstance(field_object, ForeignKey) or isinstance(field_object, ManyToManyField):
-            return SearchGroupRow(field_object.related_model.objects.filter(**db_condition), self, title, request)
+            queryset = field_object.related_model.objects.filter(**db_condition)
+            if self.limit:
+                if not queryset.ordered:
+                    queryset = queryset.order_by('pk')
+                queryset = queryset[:self.limit + 1]
+            if self.use_cache:
+                item_list = self.get_cached_item_list(field_object.related_model, db_condition, queryset)
+                return SearchGroupRow(item_list, self, title, request, is_item_list=True)
+            return SearchGroupRow(queryset, self, title, request)
+        else:
+            self.is_choice = True
+            choices = field_object.choices
+            if self.limit:
+                choices = choices[:self.limit + 1]
+            return SearchGroupRow(choices, self, title, request)
+
+    def search_item_list(self, model_class, request, keyword, offset, limit, *args, **kwargs):
+        """
+        按关键字在服务端搜索筛选项并分页，供加载"更多"筛选项的接口使用
+        :param model_class:
+        :param request:
+        :param keyword: 搜索关键字，按search_list搜索关联表，choice字段按文本搜索
+        :param offset: 起始位置
+        :param limit: 每次加载的数量
+        :return: (筛选项(值, 文本)列表, 是否还有更多)
+        """
+        field_object = model_class._meta.get_field(self.field)
+        db_condition = self.get_db_condition(request, *args, **kwargs)
+        if isinstance(field_object, ForeignKey) or isinstance(field_object, ManyToManyField):
+            queryset = field_object.related_model.objects.filter(**db_condition)
+            if keyword and self.search_list:
+                conn = Q()
+                conn.connector = 'OR'
+                for item in self.search_list:
+                    conn.children.append((item, keyword))
+                queryset = queryset.filter(conn)
+            if not queryset.ordered:
+                queryset = queryset.order_by('pk')
+            item_list = [(str(self.get_value(item)), self.get_text(item))
+                         for item in queryset[offset:offset + limit + 1]]
         else:
             self.is_choice = True
-            return SearchGroupRow(field_object.choices, self, title, request)
+            item_list = [(str(self.get_value(item)), self.get_text(item)) for item in field_object.choices]
+            if keyword:
+                item_list = [item for item in item_list if keyword in str(item[1])]
+            item_list = item_list[offset:offset + limit + 1]
+        return item_list[:limit], len(item_list) > limit
+
+    def get_cached_item_list(self, related_model, db_condition, queryset):
+        """
+        从缓存中获取关联表的筛选项(值, 文本)列表，缓存的key由关联表、关联表版本号、字段和筛选条件组成
+        :param related_model: 关联表模型类
+        :param db_condition: 数据库关联查询时的条件
+        :param queryset: 缓存未命中时查询筛选项的queryset
+        :return:
+        """
+        watch_model(related_model)
+        key = make_cache_key('option', related_model, {
+            "field": self.field,
+            "db_condition": db_condition,
+            # 不同handler中同名的lambda等函数__qualname__相同，按函数对象区分
+            "text_func": id(self.text_func) if self.text_func else None,
+            "value_func": id(self.value_func) if self.value_func else None,
+            "limit": self.limit,
+        })
+        item_list = cache.get(key)
+        if item_list is None:
+            item_list = [(str(self.get_value(item)), self.get_text(item)) for item in queryset]
+            cache.set(key, item_list, self.cache_timeout)
+        return item_list
 
     def get_text(self, field_object):
         """
@@ -174,10 +679,49 @@ class StarkHandler(object):
         self.site = site
         self.model_class = model_class
         self.prev = prev
-        self.request = None
+        if self.count_strategy == 'cached':
+            watch_model(model_class)
+        self._query_plan_cache = {}
+        self._column_plan_cache = {}
+        self._model_form_class = None
+        self._list_formset_class = None
+        self.search_backend = self.search_backend_class(self)
+        self.search_backend.install()
 
     per_page_count = 10  # 用于分页时每页现实的数据条数，可在子类中自行定制。
 
+    @property
+    def request(self):
+        """
+        当前请求。handler在注册时只实例化一次，被所有请求共用，因此请求不能保存在实例上，
+        而是保存在contextvars中，多线程、异步部署时每个请求互不影响
+        :return:
+        """
+        return _request_context.get()
+
+    @request.setter
+    def request(self, value):
+        _request_context.set(value)
+
+    def stream_with_request(self, iterator):
+        """
+        流式响应的内容在视图函数返回之后才生成，此时wrapper已经清除了当前请求，
+        用此方法包装生成器，使生成内容时仍能通过self.request获取到当前请求
+        :param iterator:
+        :return:
+        """
+        request = self.request
+
+        def inner():
+            token = _request_context.set(request)
+            try:
+                for item in iterator:
+                    yield item
+            finally:
+                _request_context.reset(token)
+
+        return inner()
+
     ########################## 列表页面需要展示的列 ####################
 
     list_display = []   # 列表页面需要展示的列
@@ -191,6 +735,116 @@ class StarkHandler(object):
         value.extend(self.list_display)
         return value
 
+    def get_field_header(self, name):
+        """
+        字段列的表头，反向关联没有verbose_name，使用关联表的名称
+        :param name: 字段名
+        :return:
+        """
+        field = self.model_class._meta.get_field(name)
+        if field.concrete:
+            return field.verbose_name
+        return field.related_model._meta.verbose_name
+
+    def get_many_accessor(self, name):
+        """
+        获取多对多、反向关联字段在数据对象上的属性名，反向关联为其访问名，例：order -> order_set
+        :param name: 字段名
+        :return: 不是多对多、反向关联字段时返回None
+        """
+        try:
+            field = self.model_class._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not (field.many_to_many or field.one_to_many):
+            return None
+        return field.name if field.concrete else field.get_accessor_name()
+
+    def get_column_header(self, key_or_func):
+        """
+        获取一列的表头，每次请求都重新计算，表头可以随request、当前语言变化
+        :param key_or_func: 字段名或者函数
+        :return:
+        """
+        if isinstance(key_or_func, FunctionType):
+            return key_or_func(self, obj=None, is_header=True)
+        return self.get_field_header(key_or_func)
+
+    def compile_column(self, key_or_func):
+        """
+        将list_display中的一项编译为Column，只生成单元格的取值函数（表头由get_column_plan每次请求填入），渲染时不再逐格判断类型
+        :param key_or_func: 字段名或者函数
+        :return:
+        """
+        meta = self.model_class._meta
+        if isinstance(key_or_func, FunctionType):
+            choice_field = getattr(key_or_func, 'choice_field', None)
+            if choice_field:
+                field = meta.get_field(choice_field)
+                # 保留惰性翻译文本，渲染时按当前语言转换
+                choice_dict = dict(field.flatchoices)
+                attname = field.attname
+
+                def accessor(obj):
+                    value = getattr(obj, attname)
+                    return choice_dict.get(value, value)
+
+                return Column(choice_field, None, accessor, 'choice')
+            annotation_name = getattr(key_or_func, 'annotation_name', None)
+            if annotation_name:
+                return Column(annotation_name, None, operator.attrgetter(annotation_name), 'annotation')
+            return Column(key_or_func.__name__, None, functools.partial(key_or_func, self, is_header=False))
+
+        related_accessor = self.get_many_accessor(key_or_func)
+        if related_accessor:
+            def accessor(obj):
+                return ', '.join(str(item) for item in getattr(obj, related_accessor).all())
+
+            return Column(key_or_func, None, accessor, 'many')
+        return Column(key_or_func, None, operator.attrgetter(key_or_func), 'field')
+
+    column_plan_cache_size = 64  # 编译后的列最多缓存的list_display组合数，超过后清空重新缓存
+
+    def get_column_key(self, key_or_func):
+        """
+        获取一列在列缓存中的标识。get_choice_text、get_annotation_text每次调用都生成新的函数，
+        按字段名（计算列名称）标识，在get_list_display中每次请求重新生成时仍能命中缓存
+        :param key_or_func: 字段名或者函数
+        :return:
+        """
+        if isinstance(key_or_func, FunctionType):
+            choice_field = getattr(key_or_func, 'choice_field', None)
+            if choice_field:
+                return 'choice', choice_field
+            annotation_name = getattr(key_or_func, 'annotation_name', None)
+            if annotation_name:
+                return 'annotation', annotation_name
+        return key_or_func
+
+    def get_column_plan(self, list_display=None):
+        """
+        获取编译后的列，取值函数按list_display缓存在handler上，表头每次请求重新计算，表头和每行数据都使用同一份列
+        :param list_display: 要显示的列，默认为get_list_display()
+        :return: Column列表
+        """
+        if list_display is None:
+            list_display = self.get_list_display()
+        cache_key = tuple(self.get_column_key(key_or_func) for key_or_func in list_display)
+        column_plan = self._column_plan_cache.get(cache_key)
+        if column_plan is None:
+            if list_display:
+                column_plan = [self.compile_column(key_or_func) for key_or_func in list_display]
+            else:
+                column_plan = [Column('__str__', None, lambda obj: obj)]
+            # 其他每次请求都生成新函数的自定义列无法命中缓存，限制缓存数量避免无限增长
+            if len(self._column_plan_cache) >= self.column_plan_cache_size:
+                self._column_plan_cache.clear()
+            self._column_plan_cache[cache_key] = column_plan
+        if not list_display:
+            return [Column('__str__', self.model_class._meta.model_name, column_plan[0].accessor)]
+        return [Column(column.key, self.get_column_header(key_or_func), column.accessor, column.kind)
+                for column, key_or_func in zip(column_plan, list_display)]
+
     def display_check(self, obj=None, is_header=None):
         """
         多选框列， 可在子类中将此函数加入list_display列表中，即可在页面上显示多选框列。
@@ -231,6 +885,96 @@ class StarkHandler(object):
 
 
 
+    ########################### 行内编辑设置 ###########################
+
+    list_editable = []  # 列表页面可直接编辑的列，需同时出现在list_display中，支持普通字段、ForeignKey和get_choice_text列，
+                        # 例：list_editable = ['age', 'gender']
+
+    def get_list_editable(self):
+        """
+        获取列表页面可直接编辑的列
+        :return:
+        """
+        return list(self.list_editable)
+
+    def get_list_formset_class(self):
+        """
+        获取行内编辑的formset类，每个handler只生成一次
+        :return:
+        """
+        if self._list_formset_class is None:
+            formset_class = modelformset_factory(self.model_class, form=ListEditForm, formset=ListEditFormSet,
+                                                 fields=self.get_list_editable(), extra=0)
+            formset_class.form = self.apply_autocomplete_widgets(formset_class.form)
+            self._list_formset_class = formset_class
+        return self._list_formset_class
+
+    def render_editable_cell(self, form, name, with_pk=False):
+        """
+        生成可编辑单元格的内容：输入框和错误信息
+        :param form: 该行数据的form
+        :param name: 字段名
+        :param with_pk: 是否同时输出该行的主键隐藏字段
+        :return:
+        """
+        html = str(form[name])
+        if with_pk:
+            html = str(form[self.model_class._meta.pk.name]) + html
+        if form[name].errors:
+            html += '<span style="color:firebrick;">%s</span>' % conditional_escape(form[name].errors[0])
+        return mark_safe(html)
+
+    def save_inline(self, form_list):
+        """
+        保存行内编辑修改过的数据，按修改的字段分组，每组执行一次bulk_update，只写入修改过的行和字段，全部在一个事务中执行。
+        设置了version_field时同时更新版本，使已打开的编辑页面提交时能发现数据已被修改。
+        可在子类中重写该方法，例如记录修改日志
+        :param form_list: 修改过的form列表
+        :return:
+        """
+        group_dict = {}
+        for form in form_list:
+            field_names = sorted(form.changed_data)
+            if self.version_field:
+                version_field = self.model_class._meta.get_field(self.version_field)
+                if isinstance(version_field, models.DateTimeField):
+                    setattr(form.instance, version_field.attname, timezone.now())
+                else:
+                    setattr(form.instance, version_field.attname, models.F(version_field.attname) + 1)
+                field_names.append(self.version_field)
+            group_dict.setdefault(tuple(field_names), []).append(form.instance)
+        using = router.db_for_write(self.model_class)
+        with transaction.atomic(using=using):
+            for field_names, obj_list in group_dict.items():
+                self.model_class._default_manager.bulk_update(obj_list, field_names, batch_size=self.bulk_chunk_size)
+        # bulk_update不会触发post_save信号，需手动使缓存失效并更新搜索索引
+        bump_model_version(self.model_class)
+        # 版本字段可能是F()表达式，按主键从数据库重新读取后建立索引
+        self.search_backend.index_pk_list([form.instance.pk for form in form_list], using=using)
+
+    def inline_edit(self, request, *args, **kwargs):
+        """
+        处理列表页面行内编辑的提交，全部验证通过时保存并返回列表页面，否则在列表页面显示错误信息
+        :param request:
+        :return:
+        """
+        formset = self.get_list_formset_class()(data=request.POST)
+        if formset.is_valid():
+            form_list = [form for form in formset.forms if form.instance.pk is not None and form.has_changed()]
+            if form_list:
+                self.save_inline(form_list)
+            return redirect(request.get_full_path())
+        changelist = self.get_changelist(request, *args, **kwargs)
+        for task in changelist["task_list"]:
+            task()
+        return self.render_changelist(request, changelist, formset=formset)
+
+    #-----------------------------------------------------------------#
+
+
+
+
+
     ########################### 添加按钮控制 ###########################
 
     has_add_btn = True     # 是否显示添加数据按钮，可用于权限控制，根据用户不同，是否展示添加按钮。可在子类中自行定制
@@ -254,10 +998,11 @@ class StarkHandler(object):
     ######################### 获取modelform类 #########################
 
     model_form_class = None          # 数据库表模型Form类，可在子类中自行定义modelform
+    cache_model_form = True          # 是否缓存生成的Form类，Form类随请求不同而不同时（例如根据用户显示不同字段）设置为False
 
-    def get_model_form_class(self):
+    def create_model_form_class(self):
         """
-        获取数据库表模型Form类，并继承StarkModelForm，为字段加上前端样式
+        生成数据库表模型Form类，并继承StarkModelForm，为字段加上前端样式
         :return:
         """
         if self.model_form_class:
@@ -267,9 +1012,125 @@ class StarkHandler(object):
             class Meta:
                 model = self.model_class
                 fields = '__all__'
+                exclude = [self.version_field] if self.version_field else []
 
         return DynamicModelForm
 
+    def get_model_form_class(self):
+        """
+        获取数据库表模型Form类，每个handler只生成一次，之后直接使用缓存的Form类
+        :return:
+        """
+        if not self.cache_model_form:
+            return self.apply_autocomplete_widgets(self.create_model_form_class())
+        if self._model_form_class is None:
+            self._model_form_class = self.apply_autocomplete_widgets(self.create_model_form_class())
+        return self._model_form_class
+
+    def invalidate_model_form_class(self):
+        """
+        清除缓存的Form类，下次获取时重新生成，例如运行中修改了model_form_class或字段配置后调用
+        :return:
+        """
+        self._model_form_class = None
+        self._list_formset_class = None
+
+    autocomplete_fields = []  # 使用自动补全下拉框的ForeignKey、多对多字段，可在子类中自行定制
+    autocomplete_threshold = 1000  # 关联表数据条数超过该值的字段自动使用自动补全下拉框，为None时只对autocomplete_fields生效
+    autocomplete_page_size = 20  # 自动补全每次加载的选项数量
+
+    @staticmethod
+    def get_choice_queryset(form_field):
+        """
+        获取关联字段可选数据的queryset。Form类的base_fields上还没有应用模型字段的limit_choices_to，
+        Form实例化时才会应用，因此在字段的副本上应用后再返回
+        :param form_field: Form类中的ModelChoiceField
+        :return:
+        """
+        form_field = copy.deepcopy(form_field)
+        apply_limit_choices_to_to_formfield(form_field)
+        return form_field.queryset
+
+    def is_large_related(self, queryset):
+        """
+        判断关联表的数据条数是否超过autocomplete_threshold，最多只统计到autocomplete_threshold + 1条
+        :param queryset: 关联字段可选数据的queryset，见get_choice_queryset
+        :return:
+        """
+        if self.autocomplete_threshold is None:
+            return False
+        return queryset.order_by()[:self.autocomplete_threshold + 1].count() > self.autocomplete_threshold
+
+    def apply_autocomplete_widgets(self, form_class):
+        """
+        将需要自动补全的关联字段替换为自动补全下拉框，生成新的Form子类，不修改原Form类
+        :param form_class:
+        :return:
+        """
+        name_list = []
+        for name, field in form_class.base_fields.items():
+            if not isinstance(field, forms.ModelChoiceField):
+                continue
+            if name in self.autocomplete_fields or self.is_large_related(self.get_choice_queryset(field)):
+                name_list.append(name)
+        if not name_list:
+            return form_class
+
+        new_class = type(form_class.__name__, (form_class,), {'__module__': form_class.__module__})
+        for name in name_list:
+            field = copy.deepcopy(new_class.base_fields[name])
+            if isinstance(field, forms.ModelMultipleChoiceField):
+                widget_class = AutocompleteSelectMultiple
+            else:
+                widget_class = AutocompleteSelect
+            autocomplete_url = reverse('%s:%s' % (self.site.namespace, self.get_autocomplete_url_name),
+                                       kwargs={'field': name})
+            widget = widget_class(autocomplete_url, attrs=dict(field.widget.attrs))
+            widget.is_required = field.required
+            widget.choices = field.choices
+            field.widget = widget
+            new_class.base_fields[name] = field
+        return new_class
+
+    def autocomplete_view(self, request, field, *args, **kwargs):
+        """
+        自动补全下拉框加载选项的视图函数，按主键分页（after为上一页最后一条数据的主键），
+        关键字按关联表handler的search_list搜索，返回JSON
+        :param request:
+        :param field: Form中的关联字段
+        :return:
+        """
+        form_field = self.get_model_form_class().base_fields.get(field)
+        if not isinstance(form_field, forms.ModelChoiceField):
+            return JsonResponse({"results": [], "more": False, "after": None}, status=404)
+        queryset = self.get_choice_queryset(form_field)
+        term = request.GET.get("term", '').strip()
+        if term:
+            related_handler = self.site.get_handler(queryset.model)
+            if related_handler and related_handler.get_search_list():
+                queryset = related_handler.search_backend.filter(queryset, term)
+                if related_handler.get_query_plan()["search_distinct"]:
+                    queryset = queryset.distinct()
+        queryset = queryset.order_by('pk')
+        after = request.GET.get("after")
+        if after:
+            try:
+                queryset = queryset.filter(pk__gt=after)
+            except (ValueError, ValidationError):
+                pass
+
+        row_list = list(queryset[:self.autocomplete_page_size + 1])
+        has_more = len(row_list) > self.autocomplete_page_size
+        row_list = row_list[:self.autocomplete_page_size]
+        results = [{"id": form_field.prepare_value(obj), "text": form_field.label_from_instance(obj)}
+                   for obj in row_list]
+        return JsonResponse({"results": results,
+                             "more": has_more,
+                             "after": row_list[-1].pk if row_list else None, })
+
+    version_field = None  # 乐观锁字段，可在子类中自行定制。IntegerField每次修改加一，DateTimeField每次修改更新为当前时间；
+                          # 设置后编辑时只有该字段仍是打开编辑页面时的值才会保存，否则提示数据已被他人修改
+
     def save(self, form, is_update=False):
         """
         编辑或新增数据时，通过form对象进行新增或修改数据函数
@@ -278,7 +1139,102 @@ class StarkHandler(object):
         :param is_update:
         :return:
         """
-        form.save()
+        if is_update:
+            self.save_changed(form)
+        else:
+            form.save()
+
+    def get_version_value(self, obj):
+        """
+        获取数据的乐观锁字段的值（字符串形式），用于编辑页面的隐藏字段
+        :param obj:
+        :return: 没有设置version_field时返回None
+        """
+        if not self.version_field:
+            return None
+        return self.model_class._meta.get_field(self.version_field).value_to_string(obj)
+
+    def get_update_fields(self, form, using=None):
+        """
+        获取编辑时需要写入数据库的字段：form中修改过的字段、实例上与数据库中的值不同的字段，有修改时再加上auto_now字段；
+        子类重写save()在调用super()之前给form.instance设置的值（如修改人、计算字段）也会被写入
+        可在子类中重写该方法，自行指定要写入的字段
+        :param form:
+        :param using: 数据库别名
+        :return: 字段对象列表
+        """
+        meta = self.model_class._meta
+        instance = form.instance
+        concrete_dict = {field.name: field for field in meta.concrete_fields}
+        field_list = [concrete_dict[name] for name in form.changed_data
+                      if name in concrete_dict and not concrete_dict[name].primary_key]
+
+        deferred_set = instance.get_deferred_fields()
+        other_list = [field for field in meta.concrete_fields
+                      if not field.primary_key and field not in field_list and field.attname not in deferred_set
+                      and not getattr(field, 'auto_now', False)]
+        db_values = None
+        if other_list:
+            db_values = self.model_class._default_manager.using(using).filter(pk=instance.pk).values_list(
+                *[field.attname for field in other_list]).first()
+        for field, db_value in zip(other_list, db_values or ()):
+            value = getattr(instance, field.attname)
+            if isinstance(value, (models.Expression, models.F)) or value != db_value:
+                field_list.append(field)
+
+        if field_list or form.changed_data:
+            field_list.extend(field for field in meta.concrete_fields
+                              if getattr(field, 'auto_now', False) and field not in field_list)
+        return field_list
+
+    def save_changed(self, form):
+        """
+        只写入修改过的字段（见get_update_fields）；设置了version_field时先用带版本条件的UPDATE更新版本（同时锁定该行），
+        版本不一致说明数据已被他人修改，不写入并将错误信息添加到form中；
+        版本更新成功后在同一事务中调用save(update_fields=...)写入修改的字段，模型重写的save方法和pre_save、post_save信号照常生效
+        :param form:
+        :return:
+        """
+        meta = self.model_class._meta
+        instance = form.save(commit=False)
+        using = router.db_for_write(self.model_class, instance=instance)
+        field_list = self.get_update_fields(form, using=using)
+        if not field_list and not form.changed_data:
+            return
+
+        if not self.version_field:
+            if field_list:
+                instance.save(using=using, update_fields=[field.name for field in field_list])
+            form.save_m2m()
+            return
+
+        version_field = meta.get_field(self.version_field)
+        expected = form.data.get('_version')
+        if expected in (None, ''):
+            expected = getattr(instance, version_field.attname)
+        else:
+            try:
+                expected = version_field.to_python(expected)
+            except ValidationError:
+                form.add_error(None, "数据版本错误，请刷新页面后重新编辑")
+                return
+        if isinstance(version_field, models.DateTimeField):
+            new_version = timezone.now()
+        else:
+            new_version = models.F(version_field.attname) + 1
+
+        with transaction.atomic(using=using):
+            updated = self.model_class._default_manager.using(using).filter(
+                pk=instance.pk, **{version_field.attname: expected}).update(**{version_field.attname: new_version})
+            if not updated:
+                form.add_error(None, "数据已被其他人修改，请刷新页面后重新编辑")
+                return
+            setattr(instance, version_field.attname,
+                    new_version if isinstance(version_field, models.DateTimeField) else expected + 1)
+            update_fields = [field.name for field in field_list if field != version_field]
+            update_fields.append(version_field.name)
+            instance.save(using=using, update_fields=update_fields)
+            form.save_m2m()
 
     # -----------------------------------------------------------------#
 
@@ -303,33 +1259,393 @@ class StarkHandler(object):
 
 
 
-    ############################## 搜索条件字段设置 ####################
-
-    search_list = []   # 搜索框搜索条件的字段，可在子类中自行定制，例：search_list = ['name__contains'，]；若不定制，则不显示搜索框
+    ############################## 数据库计算列设置 ####################
 
-    def get_search_list(self):
+    def get_annotations(self, list_display=None):
         """
-        获取搜索条件字段列表
-        :return: 搜索条件字段列表
+        收集列中通过get_annotation_text定义的数据库计算列，列表页面查询时统一.annotate()
+        :param list_display: 要显示的列，默认为get_list_display()
+        :return: {名称: 查询表达式}
         """
-        return self.search_list
+        if list_display is None:
+            list_display = self.get_list_display()
+        annotations = {}
+        for key_or_func in list_display:
+            name = getattr(key_or_func, 'annotation_name', None)
+            if name:
+                annotations[name] = key_or_func.annotation
+        return annotations
     #-----------------------------------------------------------------#
 
 
 
 
 
-    ######################### 批量操作设置 ###############################
-    action_list = []   # 批量操作方法列表，可在子类中自行定制，若不定制，则前端不显示批量操作下拉框， 列表中存储批量操作函数
+    ############################## 关联查询设置 ########################
 
-    def get_action_list(self):
+    list_select_related = []  # 自定义显示列函数中用到的ForeignKey/OneToOne关联，可在子类中自行定制，例：['depart__company']
+    list_prefetch_related = []  # 自定义显示列函数中用到的多对多、反向关联，可在子类中自行定制，例：['tags', 'order_set']
+
+    def get_query_plan(self):
+        """
+        分析get_list_display、get_search_group和get_search_list，生成列表页面的关联查询计划：
+        ForeignKey/OneToOne列使用select_related联表查询，多对多列使用prefetch_related一次性查询，避免每行数据再查询一次数据库。
+        这些方法可以按请求返回不同的内容，因此查询计划按其结果缓存在handler上，与get_column_plan相同
+        :return:
+        """
+        list_display = self.get_list_display()
+        search_group = self.get_search_group()
+        search_list = self.get_search_list()
+        cache_key = (tuple(self.get_column_key(key_or_func) for key_or_func in list_display),
+                     tuple(option.field for option in search_group), tuple(search_list))
+        query_plan = self._query_plan_cache.get(cache_key)
+        if query_plan is None:
+            query_plan = self.build_query_plan(list_display, search_group, search_list)
+            if len(self._query_plan_cache) >= self.column_plan_cache_size:
+                self._query_plan_cache.clear()
+            self._query_plan_cache[cache_key] = query_plan
+        return query_plan
+
+    def build_query_plan(self, list_display, search_group, search_list):
+        """
+        生成关联查询计划，见get_query_plan
+        :param list_display:
+        :param search_group:
+        :param search_list:
+        :return:
+        """
+        select_related = []
+        prefetch_related = []
+        many_fields = []
+        many_accessors = {}
+        for key_or_func in list_display:
+            if isinstance(key_or_func, FunctionType):
+                continue
+            field = self.model_class._meta.get_field(key_or_func)
+            if field.many_to_many or field.one_to_many:
+                accessor = self.get_many_accessor(key_or_func)
+                prefetch_related.append(accessor)
+                many_fields.append(key_or_func)
+                many_accessors[key_or_func] = accessor
+            elif field.many_to_one or field.one_to_one:
+                select_related.append(key_or_func)
+
+        for name in self.list_select_related:
+            if name not in select_related:
+                select_related.append(name)
+        for name in self.list_prefetch_related:
+            if name not in prefetch_related:
+                prefetch_related.append(name)
+
+        # 按多对多、反向关联筛选时，一条数据可能匹配多个关联对象，需要去重
+        distinct_fields = []
+        for option in search_group:
+            field = self.model_class._meta.get_field(option.field)
+            if field.many_to_many or field.one_to_many:
+                distinct_fields.append(option.field)
+        search_distinct = False
+        for item in search_list:
+            field = self.model_class._meta.get_field(item.split('__')[0])
+            if field.many_to_many or field.one_to_many:
+                search_distinct = True
+
+        return {"select_related": select_related,
+                "prefetch_related": prefetch_related,
+                "many_fields": many_fields,
+                "many_accessors": many_accessors,
+                "distinct_fields": distinct_fields,
+                "search_distinct": search_distinct, }
+
+    def apply_query_plan(self, queryset, search_value=None, search_group_condition=None):
+        """
+        将关联查询计划应用到queryset上
+        :param queryset:
+        :param search_value: 搜索框的关键字
+        :param search_group_condition: 组合筛选条件
+        :return:
+        """
+        plan = self.get_query_plan()
+        if plan["select_related"] and not self.is_values_rows():
+            queryset = queryset.select_related(*plan["select_related"])
+        if plan["prefetch_related"] and not self.is_values_rows():
+            queryset = queryset.prefetch_related(*plan["prefetch_related"])
+        distinct = bool(search_value) and plan["search_distinct"]
+        for key in search_group_condition or {}:
+            if key.split('__')[0] in plan["distinct_fields"]:
+                distinct = True
+        if distinct:
+            queryset = queryset.distinct()
+        return queryset
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 查询字段设置 ########################
+
+    use_only_fields = False  # 是否只查询列表页面需要的字段（.only()），表中有大文本等字段时可在子类中开启
+    use_values_rows = False  # 是否使用.values()直接查询字段值并包装为ValuesRow，不构造模型对象，比use_only_fields更省内存
+    list_only_fields = []  # 自定义显示列函数中用到的字段，开启以上两项时需要在子类中声明，否则每行数据会再查询一次，例：['email']
+
+    def is_values_rows(self):
+        """
+        是否使用ValuesRow，行内编辑需要模型对象，有可编辑列时不使用
+        :return:
+        """
+        return self.use_values_rows and not self.get_list_editable()
+
+    def get_only_fields(self):
+        """
+        根据list_display、排序字段、主键以及list_only_fields计算列表页面最少需要查询的字段
+        :return:
+        """
+        meta = self.model_class._meta
+        query_plan = self.get_query_plan()
+        names = [meta.pk.name]
+        for key_or_func in self.get_list_display():
+            if isinstance(key_or_func, FunctionType):
+                names.extend(getattr(key_or_func, 'only_fields', []))
+            elif key_or_func not in query_plan["many_fields"]:
+                names.append(key_or_func)
+        for item in self.get_order_list():
+            names.append(item.lstrip('-').split('__')[0])
+        for item in query_plan["select_related"]:
+            names.append(item.split('__')[0])
+        names.extend(self.list_only_fields)
+
+        annotations = self.get_annotations()
+        only_fields = []
+        for name in names:
+            if name in annotations:
+                continue
+            try:
+                field = meta.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and (not field.concrete or field.many_to_many):
+                continue
+            if name not in only_fields:
+                only_fields.append(name)
+        return only_fields
+
+    def apply_only_fields(self, queryset):
+        """
+        按use_only_fields、use_values_rows限制queryset查询的字段
+        :param queryset:
+        :return:
+        """
+        if self.is_values_rows():
+            meta = self.model_class._meta
+            value_fields = []
+            for name in self.get_only_fields():
+                try:
+                    value_fields.append(meta.get_field(name).attname)
+                except FieldDoesNotExist:
+                    value_fields.append(name)
+            value_fields.extend(self.get_annotations())
+            queryset = queryset.values(*value_fields)
+            queryset._iterable_class = ValuesRowIterable
+            return queryset
+        if self.use_only_fields:
+            return queryset.only(*self.get_only_fields())
+        return queryset
+
+    def load_values_rows_related(self, row_list):
+        """
+        use_values_rows模式下为当前页的ValuesRow批量加载ForeignKey、多对多关联对象，每个关联字段只查询一次
+        :param row_list:
+        :return:
+        """
+        if not row_list:
+            return row_list
+        meta = self.model_class._meta
+        query_plan = self.get_query_plan()
+        for name in query_plan["select_related"]:
+            if '__' in name:
+                continue
+            field = meta.get_field(name)
+            if not field.concrete:
+                continue
+            value_set = {row.__dict__.get(field.attname) for row in row_list} - {None}
+            object_dict = field.related_model._default_manager.in_bulk(value_set, field_name=field.target_field.name)
+            for row in row_list:
+                setattr(row, name, object_dict.get(row.__dict__.get(field.attname)))
+
+        pk_list = [row.pk for row in row_list]
+        for name in query_plan["many_fields"]:
+            field = meta.get_field(name)
+            related_dict = {pk: RelatedList() for pk in pk_list}
+            if field.many_to_many:
+                if field.concrete:
+                    m2m_field = field
+                    source_name, target_name = field.m2m_field_name(), field.m2m_reverse_field_name()
+                else:
+                    # 反向多对多，中间表两侧的字段与正向相反
+                    m2m_field = field.remote_field
+                    source_name, target_name = m2m_field.m2m_reverse_field_name(), m2m_field.m2m_field_name()
+                through = m2m_field.remote_field.through
+                source_field = through._meta.get_field(source_name)
+                link_queryset = through._default_manager.filter(**{"%s__in" % source_field.name: pk_list})
+                for link in link_queryset.select_related(target_name):
+                    related_dict[getattr(link, source_field.attname)].append(getattr(link, target_name))
+            else:
+                remote_field = field.remote_field
+                related_queryset = field.related_model._default_manager.filter(**{"%s__in" % remote_field.name: pk_list})
+                for obj in related_queryset:
+                    related_dict[getattr(obj, remote_field.attname)].append(obj)
+            for row in row_list:
+                setattr(row, query_plan["many_accessors"][name], related_dict[row.pk])
+        return row_list
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 游标分页设置 ########################
+
+    use_cursor_pagination = False  # 是否使用游标（keyset）分页，数据量很大时可在子类中开启，翻到任意页的耗时都与第一页相同
+
+    def get_cursor_order_list(self):
+        """
+        获取游标分页的排序字段，在get_order_list的基础上追加主键作为唯一的决胜字段，保证每条数据的位置唯一
+        :return:
+        """
+        order_list = list(self.get_order_list())
+        pk_name = self.model_class._meta.pk.name
+        if not any(item.lstrip('-') in ('pk', pk_name) for item in order_list):
+            if order_list and order_list[-1].startswith('-'):
+                order_list.append('-%s' % pk_name)
+            else:
+                order_list.append(pk_name)
+        return order_list
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 数据总条数统计设置 ##################
+
+    count_strategy = 'exact'  # 分页时统计数据总条数的方式，可在子类中自行定制：
+                              # 'exact'：每次请求都执行COUNT
+                              # 'cached'：缓存COUNT结果，数据新增、修改、删除时自动失效
+                              # 'estimated'：无搜索和筛选条件时使用数据库统计信息估算总数，否则执行COUNT
+                              # 'none'：不统计总数，多取一条数据判断是否存在下一页
+    count_cache_timeout = 300  # 'cached'方式下COUNT结果的缓存时间（秒）
+    count_estimate_threshold = 10000  # 'estimated'方式下估算值小于该值时仍执行COUNT，小表的COUNT本身很快
+
+    def get_count_condition(self, search_value, search_group_condition):
+        """
+        将影响总条数的搜索、筛选条件整理为统一格式，用于生成缓存key以及判断是否存在筛选条件
+        :param search_value: 搜索框的关键字
+        :param search_group_condition: 组合筛选条件
+        :return:
+        """
+        condition = {}
+        if search_value and self.get_search_list():
+            condition['q'] = search_value
+            condition['search_list'] = sorted(self.get_search_list())
+        for key, value in search_group_condition.items():
+            condition[key] = sorted(value) if isinstance(value, list) else value
+        return condition
+
+    def get_all_count(self, queryset, condition):
+        """
+        按count_strategy获取数据总条数
+        :param queryset: 已加上搜索、筛选条件的queryset
+        :param condition: get_count_condition整理后的条件
+        :return: (总条数, 是否为估算值)，'none'方式下总条数为None
+        """
+        if self.count_strategy == 'none':
+            return None, False
+        if self.count_strategy == 'estimated' and not condition:
+            estimated_count = estimate_count(self.model_class, using=queryset.db)
+            if estimated_count is not None and estimated_count >= self.count_estimate_threshold:
+                return estimated_count, True
+        if self.count_strategy == 'cached':
+            key = make_cache_key('count', self.model_class, condition)
+            all_count = cache.get(key)
+            if all_count is None:
+                all_count = queryset.count()
+                cache.set(key, all_count, self.count_cache_timeout)
+            return all_count, False
+        return queryset.count(), False
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 搜索条件字段设置 ####################
+
+    search_list = []   # 搜索框搜索条件的字段，可在子类中自行定制，例：search_list = ['name__contains'，]；若不定制，则不显示搜索框
+
+    def get_search_list(self):
+        """
+        获取搜索条件字段列表
+        :return: 搜索条件字段列表
+        """
+        return self.search_list
+
+    search_backend_class = SearchBackend  # 搜索后端，默认按search_list进行LIKE查询；
+                                          # 可改为stark.utils.search.SqliteFTSSearchBackend使用全文索引
+
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ######################### 批量操作设置 ###############################
+    action_list = []   # 批量操作方法列表，可在子类中自行定制，若不定制，则前端不显示批量操作下拉框， 列表中存储批量操作函数
+
+    def get_action_list(self):
         """
         获取批量操作方法列表
         :return: 批量操作方法列表
         """
         return self.action_list
 
-    def action_multi_delete(self, request):
+    bulk_chunk_size = 1000  # 批量操作时每个事务处理的数据条数，可在子类中自行定制
+
+    def get_action_queryset(self, request, *args, **kwargs):
+        """
+        获取批量操作要处理的数据，自定义批量操作函数中调用此方法即可。
+        页面勾选了"选择全部符合条件的数据"时返回当前搜索、筛选条件下的全部数据，否则返回当前页勾选的数据
+        :param request:
+        :return:
+        """
+        if request.POST.get("select_across") == '1':
+            return self.get_changelist_queryset(request, *args, with_annotations=False, **kwargs)
+        pk_list = request.POST.getlist("pk")
+        return self.model_class.objects.filter(pk__in=pk_list)
+
+    def delete_queryset(self, queryset):
+        """
+        按主键分块删除数据，每块一个事务
+        :param queryset:
+        :return: 删除的数据条数
+        """
+        return bulk_delete(queryset, chunk_size=self.bulk_chunk_size)
+
+    def update_queryset(self, queryset, **values):
+        """
+        按主键分块修改数据，每块一个事务，例：self.update_queryset(queryset, status=2)
+        :param queryset:
+        :param values:
+        :return: 修改的数据条数
+        """
+        using = queryset.db
+
+        def on_chunk(pk_list):
+            # update()不会触发post_save信号，需手动更新搜索索引
+            self.search_backend.index_pk_list(pk_list, using=using)
+
+        return bulk_update(queryset, chunk_size=self.bulk_chunk_size, on_chunk=on_chunk, **values)
+
+    def action_multi_delete(self, request, *args, **kwargs):
         """
         批量删除  如果想在执行完之后返回特定的值或跳转到别的页面， 那么在该函数添加返回值即可。
         若想使用此功能，在子类中将此函数添加到action_list列表中即可
@@ -337,15 +1653,542 @@ class StarkHandler(object):
         :param request:
         :return:
         """
-        pk_list = request.POST.getlist("pk")
-        self.model_class.objects.filter(id__in=pk_list).delete()
+        queryset = self.get_action_queryset(request, *args, **kwargs)
+        self.delete_queryset(queryset)
 
     action_multi_delete.text = '批量删除'   # 函数中文名称，用于前端页面显示批量操作的名称
+
+    def action_multi_delete_async(self, job, queryset):
+        """
+        后台批量删除，在后台线程中按主键分块删除，页面跳转到任务进度页面，可随时取消。
+        若想使用此功能，在子类中将此函数添加到action_list列表中即可。
+        自定义后台批量操作函数时，参数为(job, queryset)，并设置 函数名.is_async = True，
+        job为stark.utils.jobs.JobContext对象，用于分块遍历数据、上报进度和记录断点。
+        :param job:
+        :param queryset: 要处理的数据
+        :return:
+        """
+        for pk_list in job.iter_chunks(queryset, chunk_size=self.bulk_chunk_size):
+            with transaction.atomic():
+                self.model_class.objects.filter(pk__in=pk_list).delete()
+
+    action_multi_delete_async.text = '批量删除（后台执行）'
+    action_multi_delete_async.is_async = True   # 标记为后台执行的批量操作
+
+    def start_action_job(self, action_func, request, *args, **kwargs):
+        """
+        将标记为is_async的批量操作提交到后台线程池执行，请求立即返回并跳转到任务进度页面
+        :param action_func: 批量操作函数
+        :param request:
+        :return:
+        """
+        queryset = self.get_action_queryset(request, *args, **kwargs)
+        job = submit_job(action_func.text, self.get_list_url_name, action_func, queryset)
+        return redirect(self.reverse_url(self.get_job_url_name, obj_id=(job.pk,)))
+
+    def job_view(self, request, pk, *args, **kwargs):
+        """
+        后台任务进度页面视图函数，GET携带_format=json时返回任务状态用于页面轮询，POST请求取消任务
+        :param request:
+        :param pk:
+        :return:
+        """
+        fail_orphaned_jobs()
+        job = Job.objects.filter(pk=pk, handler=self.get_list_url_name).first()
+        if not job:
+            return HttpResponse("任务不存在！")
+        if request.method == 'POST':
+            Job.objects.filter(pk=pk).update(is_cancelled=True)
+            Job.objects.filter(pk=pk, status=1).update(status=5)
+            return redirect(request.get_full_path())
+        if request.GET.get('_format') == 'json':
+            return JsonResponse({"id": job.pk,
+                                 "name": job.name,
+                                 "status": job.status,
+                                 "status_text": job.get_status_display(),
+                                 "progress": job.progress,
+                                 "total": job.total,
+                                 "message": job.message,
+                                 "is_cancelled": job.is_cancelled, })
+        return render(request, 'stark/job.html', {"job": job, "cancel": self.revers_list_url()})
+    # -----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 删除设置 ###########################
+
+    delete_preview_depth = 3  # 删除预览统计关联数据的层数
+    delete_protect_depth = 10  # 检查阻止删除（PROTECT）关联的最大层数，超过delete_preview_depth的层只检查阻止删除的关联
+    delete_chunk_threshold = 1000  # 级联删除的数据超过该条数时，由深到浅分块删除关联数据，每块一个事务，避免长时间锁表
+    delete_chunk_size = 1000  # 分块删除时每块的数据条数
+
+    def get_delete_preview(self, obj):
+        """
+        统计删除obj时受影响的关联数据，每种关联只执行一条COUNT（以子查询关联上一层），不把关联数据加载到内存；
+        超过delete_preview_depth层后只沿存在数据的级联关联继续检查阻止删除的关联，直到delete_protect_depth层，
+        保证分块删除开始前就能发现阻止删除的数据
+        :param obj:
+        :return: [{"model_class": 关联表, "verbose_name": 表名, "field": 关联字段, "count": 条数,
+                   "action": 'cascade'级联删除 / 'protect'阻止删除 / 'set'置空或设置为其他值, "depth": 层数,
+                   "queryset": 受影响数据的queryset}, ...]，按深度优先排列，子关联在父关联之后
+        """
+        protect_list = [models.PROTECT, getattr(models, 'RESTRICT', models.PROTECT)]
+        preview = []
+
+        def walk(model_class, parent_queryset, depth):
+            if depth > self.delete_protect_depth:
+                return
+            protect_only = depth > self.delete_preview_depth
+            for rel in model_class._meta.get_fields(include_hidden=True):
+                if not rel.auto_created or rel.concrete or not (rel.one_to_many or rel.one_to_one):
+                    continue
+                if rel.on_delete is models.DO_NOTHING:
+                    continue
+                related_model = rel.related_model
+                queryset = related_model._base_manager.using(parent_queryset.db).filter(**{
+                    '%s__in' % rel.field.attname: parent_queryset.values(rel.field.target_field.attname)})
+                if protect_only and rel.on_delete not in protect_list:
+                    if rel.on_delete is models.CASCADE and queryset.exists():
+                        walk(related_model, queryset, depth + 1)
+                    continue
+                count = queryset.count()
+                if not count:
+                    continue
+                if rel.on_delete is models.CASCADE:
+                    action = 'cascade'
+                elif rel.on_delete in protect_list:
+                    action = 'protect'
+                else:
+                    action = 'set'
+                preview.append({"model_class": related_model,
+                                "verbose_name": related_model._meta.verbose_name,
+                                "field": rel.field.verbose_name,
+                                "count": count,
+                                "action": action,
+                                "depth": depth,
+                                "queryset": queryset, })
+                if action == 'cascade':
+                    walk(related_model, queryset, depth + 1)
+
+        walk(self.model_class, self.model_class._base_manager.filter(pk=obj.pk), 1)
+        return preview
+
+    def get_protected_error_preview(self, error):
+        """
+        删除时抛出ProtectedError、RestrictedError（阻止删除的关联超过了delete_protect_depth层）时，
+        将阻止删除的数据按表统计为与get_delete_preview相同的格式，用于页面、接口展示
+        :param error:
+        :return:
+        """
+        object_list = getattr(error, 'protected_objects', None) or getattr(error, 'restricted_objects', None) or []
+        count_dict = {}
+        for item in object_list:
+            count_dict[type(item)] = count_dict.get(type(item), 0) + 1
+        return [{"model_class": model_class,
+                 "verbose_name": model_class._meta.verbose_name,
+                 "field": '',
+                 "count": count,
+                 "action": 'protect',
+                 "depth": 1,
+                 "queryset": None, } for model_class, count in count_dict.items()]
+
+    def delete_object(self, obj, preview):
+        """
+        删除数据。级联删除的数据不超过delete_chunk_threshold时直接删除；
+        否则按预览结果由深到浅分块删除关联数据，最后删除obj本身。
+        阻止删除的关联超过delete_protect_depth层时抛出ProtectedError或RestrictedError，由调用方处理；
+        直接删除时不会删除任何数据，分块删除时已删除的块不会恢复
+        :param obj:
+        :param preview: get_delete_preview的结果
+        :return:
+        """
+        cascade_count = sum(item["count"] for item in preview if item["action"] == 'cascade')
+        if cascade_count > self.delete_chunk_threshold:
+            for item in reversed(preview):
+                if item["action"] == 'cascade':
+                    bulk_delete(item["queryset"], self.delete_chunk_size)
+        obj.delete()
+
+    # -----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 导出设置 ###########################
+
+    has_export_btn = False  # 是否在列表页面显示导出按钮，可在子类中自行定制
+    export_list = []  # 导出的列，格式同list_display；若不定制，则导出list_display中的字段列和get_choice_text列
+    export_chunk_size = 2000  # 导出时每次从数据库读取的数据条数
+    export_spool_size = 10 * 1024 * 1024  # 异步视图导出时先写入临时文件，超过该字节数后临时文件写入磁盘
+
+    def get_export_list(self):
+        """
+        获取导出的列
+        :return:
+        """
+        if self.export_list:
+            return list(self.export_list)
+        value = []
+        for key_or_func in self.get_list_display():
+            if not isinstance(key_or_func, FunctionType) or hasattr(key_or_func, 'only_fields'):
+                value.append(key_or_func)
+        return value or [field.name for field in self.model_class._meta.concrete_fields]
+
+    def get_export_btn(self, request):
+        """
+        生成导出按钮，导出时携带当前页面的搜索、筛选条件
+        :param request:
+        :return: 默认不展示导出按钮，返回none
+        """
+        if not self.has_export_btn:
+            return None
+        export_url = reverse('%s:%s' % (self.site.namespace, self.get_export_url_name))
+        query_dict = request.GET.copy()
+        query_dict._mutable = True
+        query_dict.pop('page', None)
+        query_dict.pop('cursor', None)
+        query_dict['_format'] = 'csv'
+        csv_url = "%s?%s" % (export_url, query_dict.urlencode())
+        query_dict['_format'] = 'jsonl'
+        jsonl_url = "%s?%s" % (export_url, query_dict.urlencode())
+        btn = "<a class='btn btn-default' href='%s'>导出CSV</a> <a class='btn btn-default' href='%s'>导出JSON</a>" % (
+            csv_url, jsonl_url)
+        if self.has_import_btn:
+            query_dict['_format'] = 'csv'
+            query_dict['_raw'] = '1'
+            btn += " <a class='btn btn-default' href='%s?%s'>导出可导入的CSV</a>" % (export_url, query_dict.urlencode())
+        return btn
+
+    def iter_export_objects(self, queryset):
+        """
+        使用.iterator()分块读取数据，每块数据单独加载多对多关联，内存占用与总条数无关
+        :param queryset:
+        :return:
+        """
+        prefetch_related = self.get_query_plan()["prefetch_related"]
+        queryset = queryset.prefetch_related(None)
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= self.export_chunk_size:
+                if prefetch_related:
+                    prefetch_related_objects(chunk, *prefetch_related)
+                for item in chunk:
+                    yield item
+                chunk = []
+        if chunk and prefetch_related:
+            prefetch_related_objects(chunk, *prefetch_related)
+        for item in chunk:
+            yield item
+
+    def get_export_header(self, key_or_func, raw=False):
+        """
+        获取导出时每列的表头，导出原始值时字段列和choice列使用字段名，以便导入时对应字段
+        :param key_or_func:
+        :param raw: 是否导出原始值
+        :return:
+        """
+        if isinstance(key_or_func, FunctionType):
+            choice_field = getattr(key_or_func, 'choice_field', None)
+            if raw and choice_field:
+                return choice_field
+            return str(key_or_func(self, obj=None, is_header=True))
+        if raw:
+            return key_or_func
+        return str(self.get_field_header(key_or_func))
+
+    def get_export_value(self, obj, key_or_func, raw=False):
+        """
+        获取导出时每个单元格的值
+        :param obj:
+        :param key_or_func:
+        :param raw: 是否导出原始值：外键导出主键，choice字段导出保存的值，多对多字段导出主键列表，导出的文件可以直接导入
+        :return:
+        """
+        if isinstance(key_or_func, FunctionType):
+            choice_field = getattr(key_or_func, 'choice_field', None)
+            if raw and choice_field:
+                return getattr(obj, self.model_class._meta.get_field(choice_field).attname)
+            value = key_or_func(self, obj, is_header=False)
+            return value() if callable(value) else value
+        related_accessor = self.get_many_accessor(key_or_func)
+        if related_accessor:
+            related_list = getattr(obj, related_accessor).all()
+            if raw:
+                return [item.pk for item in related_list]
+            return [str(item) for item in related_list]
+        if raw:
+            return getattr(obj, self.model_class._meta.get_field(key_or_func).attname)
+        value = getattr(obj, key_or_func)
+        if isinstance(value, models.Model):
+            return str(value)
+        return value
+
+    def get_export_content(self, request, *args, **kwargs):
+        """
+        按当前的搜索、筛选条件和排序生成导出内容，以CSV或JSON Lines格式逐行生成；
+        url携带_raw=1时导出原始值，导出的文件可以直接导入
+        :param request:
+        :return: (逐行生成内容的生成器, content_type, 文件名)
+        """
+        export_list = self.get_export_list()
+        raw = request.GET.get('_raw') == '1'
+        header_list = [self.get_export_header(key_or_func, raw) for key_or_func in export_list]
+        queryset = self.get_changelist_queryset(request, *args, **kwargs)
+        list_annotations = self.get_annotations()
+        export_annotations = {name: expression for name, expression in self.get_annotations(export_list).items()
+                              if name not in list_annotations}
+        if export_annotations:
+            queryset = queryset.annotate(**export_annotations)
+        file_name = self.model_class._meta.model_name
+
+        if request.GET.get('_format') == 'jsonl':
+            def stream():
+                for obj in self.iter_export_objects(queryset):
+                    row = {header: self.get_export_value(obj, key_or_func, raw)
+                           for header, key_or_func in zip(header_list, export_list)}
+                    yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+            return stream(), 'application/x-ndjson; charset=utf-8', '%s.jsonl' % file_name
+
+        writer = csv.writer(Echo())
+
+        def stream():
+            yield '\ufeff'
+            yield writer.writerow(header_list)
+            for obj in self.iter_export_objects(queryset):
+                tr_list = []
+                for key_or_func in export_list:
+                    value = self.get_export_value(obj, key_or_func, raw)
+                    if value is None:
+                        value = ''
+                    elif isinstance(value, list):
+                        value = ', '.join(str(item) for item in value)
+                    tr_list.append(value)
+                yield writer.writerow(tr_list)
+
+        return stream(), 'text/csv; charset=utf-8', '%s.csv' % file_name
+
+    def export_view(self, request, *args, **kwargs):
+        """
+        导出视图函数，流式返回全部数据，内存占用与总条数无关
+        :param request:
+        :return:
+        """
+        content, content_type, file_name = self.get_export_content(request, *args, **kwargs)
+        response = StreamingHttpResponse(self.stream_with_request(content), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
+        return response
+
+    def export_to_file(self, request, *args, **kwargs):
+        """
+        将导出内容全部写入临时文件后以文件响应返回，超过export_spool_size字节的部分写入磁盘而不是内存
+        :param request:
+        :return:
+        """
+        content, content_type, file_name = self.get_export_content(request, *args, **kwargs)
+        spool = tempfile.SpooledTemporaryFile(max_size=self.export_spool_size)
+        for chunk in content:
+            spool.write(chunk.encode('utf-8'))
+        spool.seek(0)
+        response = FileResponse(spool, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
+        return response
+
+    async def async_export_view(self, request, *args, **kwargs):
+        """
+        异步导出视图函数。ASGI下流式响应的内容在事件循环中生成，不能执行数据库查询，
+        因此在线程池中先将导出内容写入临时文件，再返回读取文件的响应
+        :param request:
+        :return:
+        """
+        return await sync_to_async(self.export_to_file)(request, *args, **kwargs)
+    # -----------------------------------------------------------------#
+
+
+
+
+    ############################## 导入设置 ###########################
+
+    has_import_btn = False  # 是否在列表页面显示导入按钮，可在子类中自行定制
+    import_batch_size = 500  # 导入时每批写入的数据条数，每批在一个事务中执行
+    import_max_errors = 100  # 导入时最多记录的错误行数，超过后只统计错误数量
+
+    def get_import_btn(self):
+        """
+        生成导入按钮
+        :return: 默认不展示导入按钮，返回none
+        """
+        if not self.has_import_btn:
+            return None
+        import_url = self.reverse_url(self.get_import_url_name, obj_id=None)
+        return "<a class='btn btn-default' href='%s'>导入</a>" % import_url
+
+    def iter_import_rows(self, upload, file_format):
+        """
+        逐行读取上传的文件，不将整个文件读入内存。CSV第一行为表头，JSON Lines每行一个对象；
+        表头（键）可以是字段名，也可以是字段的中文名称（与导出的表头一致）
+        :param upload: 上传的文件
+        :param file_format: 'csv'或'jsonl'
+        :return: 生成(行号, {表头: 值})
+        """
+        text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        if file_format == 'jsonl':
+            for line_number, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row
+        else:
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, row
+
+    def get_import_data(self, form_class, row):
+        """
+        将导入文件的一行转换为Form的data，多选字段的值为列表（CSV中以逗号分隔）
+        :param form_class:
+        :param row:
+        :return:
+        """
+        name_dict = {}
+        for name, field in form_class.base_fields.items():
+            name_dict[name] = name
+            if field.label:
+                name_dict[str(field.label)] = name
+        data = {}
+        for key, value in row.items():
+            name = name_dict.get(key)
+            if not name:
+                continue
+            field = form_class.base_fields[name]
+            if isinstance(field, (forms.MultipleChoiceField, forms.ModelMultipleChoiceField)):
+                if value is None:
+                    value = []
+                elif not isinstance(value, list):
+                    value = [item.strip() for item in str(value).split(',') if item.strip()]
+            data[name] = value
+        return data
+
+    def bulk_save(self, form_list):
+        """
+        批量保存验证通过的Form，可在子类中重写该方法，例如在保存前统一设置一部分不让用户输入的字段。
+        默认使用bulk_create一次写入；子类重写了save方法时逐条调用save，保证自定义的保存逻辑生效。
+        数据库不支持bulk_create返回主键时，有多对多数据的行逐条保存
+        :param form_list: 验证通过的Form列表
+        :return:
+        """
+        if type(self).save is not StarkHandler.save:
+            for form in form_list:
+                self.save(form, is_update=False)
+            return
+
+        connection = connections[router.db_for_write(self.model_class)]
+        bulk_form_list = []
+        m2m_form_list = []
+        for form in form_list:
+            has_m2m = any(form.cleaned_data.get(field.name) for field in self.model_class._meta.many_to_many)
+            if has_m2m and not connection.features.can_return_rows_from_bulk_insert:
+                form.save()
+                continue
+            form.save(commit=False)
+            bulk_form_list.append(form)
+            if has_m2m:
+                m2m_form_list.append(form)
+        obj_list = [form.instance for form in bulk_form_list]
+        self.model_class._default_manager.bulk_create(obj_list)
+        for form in m2m_form_list:
+            form.save_m2m()
+        # bulk_create不会触发post_save信号，需手动更新搜索索引
+        self.search_backend.index(obj_list, using=connection.alias)
+
+    def import_view(self, request, *args, **kwargs):
+        """
+        导入视图函数，上传CSV或JSON Lines文件，逐行通过ModelForm验证，验证通过的数据按import_batch_size分批写入，
+        每批一个事务，验证失败的行记录错误信息并跳过
+        :param request:
+        :return:
+        """
+        context = {"cancel": self.revers_list_url()}
+        if request.method == 'GET':
+            return render(request, 'stark/import.html', context)
+        upload = request.FILES.get('file')
+        if not upload:
+            context["error"] = "请选择要导入的文件"
+            return render(request, 'stark/import.html', context)
+        file_format = request.POST.get('_format')
+        if file_format not in ('csv', 'jsonl'):
+            file_format = 'jsonl' if upload.name.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+        form_class = self.get_model_form_class()
+        created_count = 0
+        error_count = 0
+        error_list = []
+        form_list = []
+
+        def add_error(line_number, errors):
+            if len(error_list) < self.import_max_errors:
+                error_list.append({"line": line_number, "errors": errors})
+
+        def flush():
+            with transaction.atomic(using=router.db_for_write(self.model_class)):
+                self.bulk_save([form for line_number, form in form_list])
+
+        try:
+            for line_number, row in self.iter_import_rows(upload, file_format):
+                if not isinstance(row, dict):
+                    error_count += 1
+                    add_error(line_number, {"__all__": ["数据格式错误"]})
+                    continue
+                form = form_class(data=self.get_import_data(form_class, row))
+                if not form.is_valid():
+                    error_count += 1
+                    add_error(line_number, {name: [str(message) for message in message_list]
+                                            for name, message_list in form.errors.items()})
+                    continue
+                form_list.append((line_number, form))
+                if len(form_list) >= self.import_batch_size:
+                    try:
+                        flush()
+                        created_count += len(form_list)
+                    except DatabaseError as e:
+                        error_count += len(form_list)
+                        add_error(form_list[0][0], {"__all__": ["第%s-%s行写入失败：%s" % (
+                            form_list[0][0], form_list[-1][0], e)]})
+                    form_list = []
+            if form_list:
+                try:
+                    flush()
+                    created_count += len(form_list)
+                except DatabaseError as e:
+                    error_count += len(form_list)
+                    add_error(form_list[0][0], {"__all__": ["第%s-%s行写入失败：%s" % (
+                        form_list[0][0], form_list[-1][0], e)]})
+        except (UnicodeDecodeError, csv.Error) as e:
+            context["error"] = "文件读取失败：%s" % e
+        finally:
+            if created_count:
+                # bulk_create不会触发post_save信号，需手动使缓存失效
+                bump_model_version(self.model_class)
+
+        context.update({"created_count": created_count,
+                        "error_count": error_count,
+                        "error_list": error_list,
+                        "is_done": True, })
+        return render(request, 'stark/import.html', context)
+
     # -----------------------------------------------------------------#
 
 
 
 
+
     ############################## 多条件筛选设置 #######################
     search_group = []  # 用于筛选的字段的option对象列表
     """
@@ -363,6 +2206,81 @@ class StarkHandler(object):
         """
         return self.search_group
 
+    def get_facet_counts(self, option, request, *args, **kwargs):
+        """
+        用一条GROUP BY查询统计某个组合筛选字段每个值对应的数据条数，统计时使用当前的搜索和其他字段的筛选条件，
+        不包含该字段自身的筛选条件。count_strategy为'cached'时与总条数使用相同的条件缓存
+        :param option: Option对象
+        :param request: 列表页面的request
+        :return: {筛选项的值: 数据条数}
+        """
+        use_cache = self.count_strategy == 'cached'
+        if use_cache:
+            condition = self.get_count_condition(request.GET.get("q", ''), self.get_search_group_condition(request))
+            condition = {key: value for key, value in condition.items()
+                         if key not in (option.field, '%s__in' % option.field)}
+            key = make_cache_key('facet:%s' % option.field, self.model_class, condition)
+            facet_counts = cache.get(key)
+            if facet_counts is not None:
+                return facet_counts
+
+        queryset = self.get_changelist_queryset(request, *args, exclude_field=option.field, with_annotations=False,
+                                                **kwargs)
+        queryset = queryset.prefetch_related(None).order_by().values(option.field).annotate(
+            stark_count=Count('pk', distinct=True)).values_list(option.field, 'stark_count')
+        facet_counts = {str(value): count for value, count in queryset}
+        if use_cache:
+            cache.set(key, facet_counts, self.count_cache_timeout)
+        return facet_counts
+
+    def get_search_group_more_url(self, option, request):
+        """
+        生成加载"更多"筛选项的url，携带当前列表页面的url参数，用于生成每个筛选项的链接
+        :param option:
+        :param request:
+        :return:
+        """
+        base_url = reverse('%s:%s' % (self.site.namespace, self.get_search_group_url_name),
+                           kwargs={"field": option.field})
+        query_dict = QueryDict(mutable=True)
+        query_dict['_filter'] = request.GET.urlencode()
+        return "%s?%s" % (base_url, query_dict.urlencode())
+
+    def search_group_view(self, request, field, *args, **kwargs):
+        """
+        加载"更多"筛选项的视图函数，支持关键字搜索和分页，返回JSON
+        :param request:
+        :param field: 筛选的字段
+        :return:
+        """
+        option = None
+        for item in self.get_search_group():
+            if item.field == field:
+                option = item
+                break
+        if not option:
+            return JsonResponse({"results": [], "more": False}, status=404)
+        try:
+            offset = max(int(request.GET.get("offset", 0)), 0)
+        except ValueError:
+            offset = 0
+        keyword = request.GET.get("keyword", '')
+        item_list, has_more = option.search_item_list(self.model_class, request, keyword, offset, option.limit or 100,
+                                                      *args, **kwargs)
+        row = SearchGroupRow(item_list, option, '', request, is_item_list=True,
+                             query_dict=QueryDict(request.GET.get("_filter", '')))
+        origin_value_list, base = row.get_param_base()
+        facet_counts = None
+        if option.show_count:
+            facet_counts = self.get_facet_counts(option, QueryRequest(request, row.query_dict), *args, **kwargs)
+        results = []
+        for param, text, is_active, value in row.iter_links(item_list, origin_value_list, base):
+            item = {"text": str(text), "url": "?%s" % param, "active": is_active}
+            if facet_counts is not None:
+                item["count"] = facet_counts.get(value, 0)
+            results.append(item)
+        return JsonResponse({"results": results, "more": has_more})
+
     def get_search_group_condition(self, request):
         """
         从url的参数中获取筛选条件
@@ -389,103 +2307,518 @@ class StarkHandler(object):
 
 
 
+    ############################## 页面缓存设置 ########################
+
+    use_page_cache = False  # 是否缓存列表页面，可在子类中自行定制。按url参数和用户缓存，数据表（含关联表）数据变化时自动失效，
+                            # 并通过ETag响应304，浏览器重复刷新同一页面时无需重新查询和渲染
+    page_cache_timeout = 60  # 列表页面的缓存时间（秒）
+    page_cache_models = []  # 除自动分析出的关联表外，页面内容还依赖的其他数据表，例如自定义显示列中查询的表
+
+    def get_path_models(self, path):
+        """
+        获取跨表查询路径经过的关联表，例：depart__company -> [Depart, Company]，遇到非关联字段时停止
+        :param path:
+        :return:
+        """
+        model_list = []
+        model_class = self.model_class
+        for name in path.split('__'):
+            try:
+                model_class = model_class._meta.get_field(name).related_model
+            except FieldDoesNotExist:
+                model_class = None
+            if model_class is None:
+                break
+            model_list.append(model_class)
+        return model_list
+
+    def get_expression_models(self, expression):
+        """
+        获取数据库计算列的查询表达式引用的数据表，例：Count('order') -> [Order]；
+        Subquery、Exists取子查询中的全部数据表
+        :param expression: 查询表达式、Q对象或查询路径
+        :return:
+        """
+        if isinstance(expression, str):
+            return self.get_path_models(expression)
+        if isinstance(expression, F):
+            return self.get_path_models(expression.name)
+        model_list = []
+        if isinstance(expression, Q):
+            for child in expression.children:
+                if isinstance(child, Q):
+                    model_list.extend(self.get_expression_models(child))
+                    continue
+                model_list.extend(self.get_path_models(child[0]))
+                if not isinstance(child[1], str):
+                    model_list.extend(self.get_expression_models(child[1]))
+            return model_list
+        query = getattr(expression, 'query', None)
+        if query is not None and hasattr(query, 'alias_map'):
+            table_dict = {model_class._meta.db_table: model_class
+                          for model_class in apps.get_models(include_auto_created=True)}
+            model_list.append(query.model)
+            model_list.extend(table_dict[join.table_name] for join in query.alias_map.values()
+                              if join.table_name in table_dict)
+            return model_list
+        if hasattr(expression, 'get_source_expressions'):
+            for source in expression.get_source_expressions():
+                if source is not None:
+                    model_list.extend(self.get_expression_models(source))
+        return model_list
+
+    def get_page_cache_models(self):
+        """
+        获取列表页面内容依赖的数据表：当前表、显示列和组合筛选中的关联表、数据库计算列引用的表以及page_cache_models
+        :return:
+        """
+        model_list = [self.model_class]
+        query_plan = self.get_query_plan()
+        path_list = query_plan["select_related"] + query_plan["prefetch_related"]
+        for path in path_list:
+            model_list.extend(self.get_path_models(getattr(path, 'prefetch_through', path)))
+        for expression in self.get_annotations().values():
+            model_list.extend(self.get_expression_models(expression))
+        for option in self.get_search_group():
+            model_list.append(self.model_class._meta.get_field(option.field).related_model)
+        model_list.extend(self.page_cache_models)
+
+        result = []
+        for model_class in model_list:
+            if model_class is not None and model_class not in result:
+                result.append(model_class)
+        return result
+
+    def get_page_cache_key(self, request):
+        """
+        生成列表页面的缓存key，由handler、完整url参数、用户、CSRF token以及所有依赖表的版本号组成
+        :param request:
+        :return: 不缓存时返回None
+        """
+        if not self.use_page_cache or request.method != 'GET':
+            return None
+        # 依赖的数据表随get_list_display等按请求变化，在生成key时监听，watch_model重复调用只会连接一次
+        page_cache_models = self.get_page_cache_models()
+        for model_class in page_cache_models:
+            watch_model(model_class)
+        user = getattr(request, 'user', None)
+        return make_cache_key('page', self.model_class, {
+            'handler': self.get_list_url_name,
+            'path': request.get_full_path(),
+            'user': getattr(user, 'pk', None),
+            'csrf': request.META.get('CSRF_COOKIE'),
+            'versions': [get_model_version(model_class) for model_class in page_cache_models[1:]],
+        })
+
+    def get_cached_page(self, request, page_cache_key):
+        """
+        从缓存中获取列表页面，请求中的If-None-Match与缓存的ETag一致时返回304
+        :param request:
+        :param page_cache_key:
+        :return: 没有缓存时返回None
+        """
+        if not page_cache_key:
+            return None
+        cached = cache.get(page_cache_key)
+        if not cached:
+            return None
+        content, content_type, etag = cached
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def set_cached_page(self, request, page_cache_key, response):
+        """
+        缓存列表页面并添加ETag，请求中的If-None-Match与新生成的ETag一致时同样返回304。
+        渲染期间key发生变化（数据被修改，或页面中生成了新的CSRF token）时不缓存
+        :param request:
+        :param page_cache_key:
+        :param response:
+        :return:
+        """
+        if not page_cache_key or response.status_code != 200:
+            return response
+        if page_cache_key != self.get_page_cache_key(request):
+            return response
+        etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+        cache.set(page_cache_key, (response.content, response['Content-Type'], etag), self.page_cache_timeout)
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    #-----------------------------------------------------------------#
+
+
+
+
+
+    ############################## 流式渲染设置 ########################
+
+    use_stream_rendering = False  # 是否流式渲染列表页面，可在子类中自行定制。每页数据很多时（per_page_count较大）开启，
+                                  # 表格行逐块查询、逐块输出，内存占用平稳，浏览器也能更早收到页面。流式渲染的页面不使用页面缓存
+    stream_chunk_size = 200  # 流式渲染时每块的数据条数
+
+    #-----------------------------------------------------------------#
+
+
+
+
+
     ############################### 视图函数 #########################
 
-    def changelist_view(self, request, *args, **kwargs):
+    def get_changelist_queryset(self, request, *args, exclude_field=None, with_annotations=True, **kwargs):
         """
-        列表页面视图函数
+        根据搜索框关键字、组合筛选条件和排序字段生成列表数据的queryset，列表页面、导出等功能共用
         :param request:
+        :param exclude_field: 不参与筛选的组合筛选字段，用于统计该字段每个筛选项的数据条数
+        :param with_annotations: 是否计算数据库计算列，统计条数、批量操作时不需要，同时去掉按计算列的排序
+        :return:
+        """
+        search_value = request.GET.get("q", '') if self.get_search_list() else ''
+        order_list = self.get_order_list()
+        search_group_condition = self.get_search_group_condition(request)
+        if exclude_field:
+            search_group_condition = {key: value for key, value in search_group_condition.items()
+                                      if key not in (exclude_field, '%s__in' % exclude_field)}
+        annotations = self.get_annotations()
+        if not with_annotations:
+            order_list = [item for item in order_list if item.lstrip('-') not in annotations]
+        queryset = self.model_class.objects.filter(**search_group_condition)
+        if not with_annotations or not annotations:
+            # 先排序再搜索，搜索后端可以将相关度排在已有排序之前
+            queryset = queryset.order_by(*order_list)
+            if search_value:
+                queryset = self.search_backend.filter(queryset, search_value)
+            return self.apply_query_plan(queryset, search_value, search_group_condition)
+
+        if search_group_condition or search_value:
+            # 按多对多、反向关联筛选时的联表会使计算列的统计结果成倍增加，
+            # 因此筛选放在子查询中，计算列在不带筛选联表的外层查询上计算；外层按主键匹配，无需再去重
+            if search_value:
+                queryset = self.search_backend.filter(queryset, search_value)
+            queryset = self.model_class.objects.filter(pk__in=queryset.values('pk'))
+        queryset = queryset.annotate(**annotations).order_by(*order_list)
+        if search_value:
+            # 外层查询不带搜索条件，由搜索后端补上相关度排序
+            queryset = self.search_backend.order(queryset, search_value)
+        return self.apply_query_plan(queryset)
+
+    def get_action_dict(self):
+        """
+        获取批量操作 函数名:中文名称 字典
+        :return:
+        """
+        return {func.__name__: func.text for func in self.get_action_list()}
+
+    def run_action(self, request, *args, **kwargs):
+        """
+        执行列表页面POST提交的批量操作
+        :param request:
+        :return: 批量操作函数的返回值
+        """
+        action_func_name = request.POST.get("action")
+        if not action_func_name or action_func_name not in self.get_action_dict():
+            return None
+        action_func = getattr(self, action_func_name)
+        if getattr(action_func, 'is_async', False):
+            return self.start_action_job(action_func, request, *args, **kwargs)
+        return action_func(request, *args, **kwargs)
+
+    def get_page_data(self, pagination, queryset):
+        """
+        获取当前页的数据
+        :param pagination: 分页对象
+        :param queryset:
+        :return:
+        """
+        data_list = pagination.slice_queryset(queryset)
+        if self.is_values_rows():
+            return self.load_values_rows_related(list(data_list))
+        return list(data_list)
+
+    def get_changelist(self, request, *args, with_data=True, **kwargs):
+        """
+        准备列表页面需要的数据，所有数据库查询都放在task_list中，
+        同步视图中依次执行，异步视图中并发执行，执行完后各项数据保存在返回的字典中
+        :param request:
+        :param with_data: 是否查询当前页数据，流式渲染时当前页数据在生成响应内容时才逐块查询
         :return:
         """
-        self.request = request
         ########################### 显示列 #############################
-        list_display = self.get_list_display()
-        header_list = []
-        if list_display:
-            for key_or_func in list_display:
-                if isinstance(key_or_func, FunctionType):
-                    verbose_name = key_or_func(self, obj=None, is_header=True)
-                else:
-                    verbose_name = self.model_class._meta.get_field(key_or_func).verbose_name
-                header_list.append(verbose_name)
-        else:
-            header_list.append(self.model_class._meta.model_name)
+        column_plan = self.get_column_plan()
+        header_list = [column.header for column in column_plan]
+
+        changelist = {"column_plan": column_plan,
+                      "header_list": header_list,
+                      "search_list": self.get_search_list(),
+                      "search_value": request.GET.get("q", ''),
+                      "action_dict": self.get_action_dict(),
+                      "data_list": [], }
+        task_list = []
 
         ############################ 组合筛选 #############################
 
-        search_group = self.get_search_group()
         search_group_row_list = []
-        for option_object in search_group:
+        for option_object in self.get_search_group():
             queryset_or_tuple = option_object.get_queryset_or_tuple(self.model_class, request, *args, **kwargs)
+            if option_object.limit:
+                queryset_or_tuple.more_url = self.get_search_group_more_url(option_object, request)
+            task_list.append(queryset_or_tuple.load)
+            if option_object.show_count:
+                task_list.append(functools.partial(self.load_facet_counts, queryset_or_tuple, request, *args, **kwargs))
             search_group_row_list.append(queryset_or_tuple)
-
-        ############################ 多选action #############################
-        action_list = self.get_action_list()
-        action_dict = {func.__name__: func.text for func in action_list}
-
-        if request.method == 'POST':
-            action_func_name = request.POST.get("action")
-            if action_func_name and action_func_name in action_dict:
-                action_response = getattr(self, action_func_name)(request, *args, **kwargs)
-                if action_response:
-                    return action_response
-        ############################ 模糊搜索 #############################
-        search_list = self.get_search_list()
-        search_value = request.GET.get("q", '')
-        conn = Q()
-        conn.connector = 'OR'
-        if search_value:
-            for item in search_list:
-                conn.children.append((item, search_value))
-
-        ############################ 获取排序 #############################
-
-        order_list = self.get_order_list()
+        changelist["search_group_row_list"] = search_group_row_list
 
         ############################ 分页操作 #############################
 
         search_group_condition = self.get_search_group_condition(request)
-        queryset = self.model_class.objects.filter(conn).filter(**search_group_condition).order_by(*order_list)
+        queryset = self.get_changelist_queryset(request, *args, **kwargs)
+        queryset = self.apply_only_fields(queryset)
 
-        all_count = queryset.count()
         query_params = request.GET.copy()
         query_params._mutable = True
 
-        pagination = Pagination(current_page=request.GET.get("page"),
-                                all_count=all_count,
-                                base_url=request.path_info,
-                                query_params=query_params,
-                                per_page=self.per_page_count, )
+        if self.use_cursor_pagination:
+            pagination = CursorPagination(cursor=request.GET.get("cursor"),
+                                          order_list=self.get_cursor_order_list(),
+                                          base_url=request.path_info,
+                                          query_params=query_params,
+                                          per_page=self.per_page_count,
+                                          model_class=self.model_class, )
+        else:
+            pagination = Pagination(current_page=request.GET.get("page"),
+                                    all_count=None,
+                                    base_url=request.path_info,
+                                    query_params=query_params,
+                                    per_page=self.per_page_count, )
+            count_condition = self.get_count_condition(changelist["search_value"], search_group_condition)
+            # 有计算列时统计条数不带annotate，避免GROUP BY子查询
+            count_queryset = queryset
+            if self.get_annotations():
+                count_queryset = self.get_changelist_queryset(request, *args, with_annotations=False, **kwargs)
+
+            def load_count():
+                pagination.set_all_count(*self.get_all_count(count_queryset, count_condition))
+
+            task_list.append(load_count)
+        changelist["pagination"] = pagination
+        changelist["queryset"] = queryset
+
+        def load_data():
+            changelist["data_list"] = self.get_page_data(pagination, queryset)
+
+        if with_data:
+            task_list.append(load_data)
+        changelist["task_list"] = task_list
+        return changelist
+
+    def load_facet_counts(self, search_group_row, request, *args, **kwargs):
+        """
+        查询组合筛选行的每个筛选项对应的数据条数
+        :param search_group_row: SearchGroupRow对象
+        :param request:
+        :return:
+        """
+        search_group_row.facet_counts = self.get_facet_counts(search_group_row.option, request, *args, **kwargs)
 
-        data_list = queryset[pagination.start:pagination.end]
+    def get_changelist_context(self, request, changelist, body_list):
+        """
+        列表页面模板的上下文
+        :param request:
+        :param changelist:
+        :param body_list: 每行数据单元格内容的列表
+        :return:
+        """
+        return {"header_list": changelist["header_list"],
+                "body_list": body_list,
+                "pagination": changelist["pagination"],
+                "add_btn": self.get_add_btn(),
+                "export_btn": self.get_export_btn(request),
+                "import_btn": self.get_import_btn(),
+                "search_list": changelist["search_list"],
+                "search_value": changelist["search_value"],
+                "action_dict": changelist["action_dict"],
+                "search_group_row_list": changelist["search_group_row_list"], }
 
-        ############################ 数据处理 #############################
+    def render_changelist(self, request, changelist, formset=None):
+        """
+        根据get_changelist准备好的数据渲染列表页面
+        :param request:
+        :param changelist:
+        :param formset: 行内编辑提交验证失败时的formset，用于显示错误信息
+        :return:
+        """
+        editable_list = self.get_list_editable()
+        if not editable_list:
+            accessor_list = [column.accessor for column in changelist["column_plan"]]
+            body_list = [[accessor(row) for accessor in accessor_list] for row in changelist["data_list"]]
+            return render(request, 'stark/change_list.html',
+                          self.get_changelist_context(request, changelist, body_list))
 
+        if formset is None:
+            formset = self.get_list_formset_class()(object_list=changelist["data_list"])
+        form_dict = {form.instance.pk: form for form in formset.forms}
         body_list = []
-        for row in data_list:
+        for row in changelist["data_list"]:
+            form = form_dict.get(row.pk)
             tr_list = []
-            if list_display:
-                for key_or_func in list_display:
-                    if isinstance(key_or_func, FunctionType):
-                        tr_list.append(key_or_func(self, row, is_header=False))
-                    else:
-                        tr_list.append(getattr(row, key_or_func))
-            else:
-                tr_list.append(row)
+            with_pk = True
+            for column in changelist["column_plan"]:
+                if form is not None and column.key in editable_list and column.kind in ('field', 'choice'):
+                    tr_list.append(self.render_editable_cell(form, column.key, with_pk))
+                    with_pk = False
+                else:
+                    tr_list.append(column.accessor(row))
             body_list.append(tr_list)
+        context = self.get_changelist_context(request, changelist, body_list)
+        context["formset"] = formset
+        return render(request, 'stark/change_list.html', context)
 
-        ############################# 添加按钮 #############################
-        add_btn = self.get_add_btn()
+    def iter_stream_chunks(self, pagination, queryset):
+        """
+        流式渲染时分块获取当前页数据。没有prefetch_related时使用queryset.iterator()一条查询流式读取，
+        否则每块单独查询以便每块执行一次prefetch_related；游标分页需要整页数据确定上一页、下一页的游标，仍一次查询整页
+        :param pagination:
+        :param queryset:
+        :return:
+        """
+        chunk_size = self.stream_chunk_size
+        if isinstance(pagination, CursorPagination):
+            data_list = pagination.slice_queryset(queryset)
+            chunks = (data_list[i:i + chunk_size] for i in range(0, len(data_list), chunk_size))
+        else:
+            use_iterator = not self.is_values_rows() and not queryset._prefetch_related_lookups
+            chunks = pagination.iter_chunks(queryset, chunk_size, use_iterator)
+        for chunk in chunks:
+            if self.is_values_rows():
+                chunk = self.load_values_rows_related(chunk)
+            yield chunk
 
-        return render(request, 'stark/change_list.html',
-                      {"header_list": header_list,
-                       "body_list": body_list,
-                       "pagination": pagination,
-                       "add_btn": add_btn,
-                       "search_list": search_list,
-                       "search_value": search_value,
-                       "action_dict": action_dict,
-                       "search_group_row_list": search_group_row_list, })
+    def stream_changelist(self, request, changelist):
+        """
+        流式渲染列表页面：先输出筛选、搜索、表头等部分，再逐块查询并输出表格行，最后输出分页，
+        页面数据不会同时全部保存在内存中
+        :param request:
+        :param changelist:
+        :return:
+        """
+        row_marker = 'stark-stream-rows-%s' % uuid.uuid4().hex
+        page_marker = 'stark-stream-pages-%s' % uuid.uuid4().hex
+        context = self.get_changelist_context(request, changelist, [])
+        context["stream_row_marker"] = row_marker
+        context["stream_page_marker"] = page_marker
+        html = render_to_string('stark/change_list.html', context, request)
+        head, rest = html.split(row_marker, 1)
+        middle, tail = rest.split(page_marker, 1)
+
+        accessor_list = [column.accessor for column in changelist["column_plan"]]
+        pagination = changelist["pagination"]
+        queryset = changelist["queryset"]
+
+        def stream():
+            yield head
+            value_context = Context(autoescape=True)
+            for chunk in self.iter_stream_chunks(pagination, queryset):
+                row_list = []
+                for row in chunk:
+                    cell_list = []
+                    for accessor in accessor_list:
+                        value = accessor(row)
+                        if callable(value):
+                            value = value()
+                        cell_list.append('<td>%s</td>' % render_value_in_context(value, value_context))
+                    row_list.append('<tr>%s</tr>' % ''.join(cell_list))
+                yield '\n'.join(row_list)
+            yield middle
+            yield pagination.page_html()
+            yield tail
+
+        return StreamingHttpResponse(self.stream_with_request(stream()), content_type='text/html; charset=utf-8')
+
+    def changelist_view(self, request, *args, **kwargs):
+        """
+        列表页面视图函数
+        :param request:
+        :return:
+        """
+        self.request = request
+        ############################ 多选action #############################
+        if request.method == 'POST':
+            if '_save_inline' in request.POST and self.get_list_editable():
+                return self.inline_edit(request, *args, **kwargs)
+            action_response = self.run_action(request, *args, **kwargs)
+            if action_response:
+                return action_response
+
+        if self.use_stream_rendering and not self.get_list_editable():
+            changelist = self.get_changelist(request, *args, with_data=False, **kwargs)
+            for task in changelist["task_list"]:
+                task()
+            return self.stream_changelist(request, changelist)
+
+        page_cache_key = self.get_page_cache_key(request)
+        response = self.get_cached_page(request, page_cache_key)
+        if response:
+            return response
+
+        changelist = self.get_changelist(request, *args, **kwargs)
+        for task in changelist["task_list"]:
+            task()
+        response = self.render_changelist(request, changelist)
+        return self.set_cached_page(request, page_cache_key, response)
+
+    async def async_changelist_view(self, request, *args, **kwargs):
+        """
+        异步列表页面视图函数，总条数、当前页数据以及每个组合筛选的查询在线程池中并发执行，
+        页面耗时约等于其中最慢的一条查询。并发的查询各自使用独立的数据库连接。
+        ASGI下流式响应的内容在事件循环中生成，不能执行数据库查询，因此异步视图不使用流式渲染
+        :param request:
+        :return:
+        """
+        if request.method == 'POST':
+            return await sync_to_async(self.changelist_view)(request, *args, **kwargs)
+        page_cache_key = await sync_to_async(self.get_page_cache_key)(request)
+        response = await sync_to_async(self.get_cached_page)(request, page_cache_key)
+        if response:
+            return response
+
+        changelist = await sync_to_async(self.get_changelist)(request, *args, **kwargs)
+        await asyncio.gather(*[sync_to_async(run_db_task, thread_sensitive=False)(task)
+                               for task in changelist["task_list"]])
+        response = await sync_to_async(self.render_changelist)(request, changelist)
+        return await sync_to_async(self.set_cached_page)(request, page_cache_key, response)
+
+    async def async_add_view(self, request, *args, **kwargs):
+        """
+        异步添加页面视图函数
+        :param request:
+        :return:
+        """
+        return await sync_to_async(self.add_view)(request, *args, **kwargs)
+
+    async def async_change_view(self, request, pk, *args, **kwargs):
+        """
+        异步编辑页面视图函数
+        :param request:
+        :param pk:
+        :return:
+        """
+        return await sync_to_async(self.change_view)(request, pk, *args, **kwargs)
+
+    async def async_delete_view(self, request, pk, *args, **kwargs):
+        """
+        异步删除页面视图函数
+        :param request:
+        :param pk:
+        :return:
+        """
+        return await sync_to_async(self.delete_view)(request, pk, *args, **kwargs)
 
     def add_view(self, request, *args, **kwargs):
         """
@@ -516,30 +2849,191 @@ class StarkHandler(object):
         model_form_class = self.get_model_form_class()
         if request.method == 'GET':
             form = model_form_class(instance=obj)
-            return render(request, 'stark/change.html', {"form": form})
+            return render(request, 'stark/change.html', {"form": form, "version": self.get_version_value(obj)})
+        version = request.POST.get('_version', self.get_version_value(obj))
         form = model_form_class(data=request.POST, instance=obj)
         if form.is_valid():
-            self.save(form, is_update=False)
-            return redirect(self.revers_list_url())
-        return render(request, 'stark/change.html', {"form": form})
+            self.save(form, is_update=True)
+            if not form.errors:
+                return redirect(self.revers_list_url())
+        return render(request, 'stark/change.html', {"form": form, "version": version})
 
     def delete_view(self, request, pk, *args, **kwargs):
         """
-        删除页面视图函数
+        删除页面视图函数，删除前展示将被级联删除、置空或阻止删除的关联数据数量
         :param request:
         :param pk:
         :return:
         """
-        if request.method == 'GET':
-            return render(request, 'stark/delete.html', {"cancel": self.revers_list_url()})
-        self.model_class.objects.filter(pk=pk).first().delete()
-        return redirect(self.revers_list_url())
+        obj = self.model_class.objects.filter(pk=pk).first()
+        if not obj:
+            return HttpResponse("要删除的数据不存在，请重新选择！")
+        preview = self.get_delete_preview(obj)
+        is_protected = any(item["action"] == 'protect' for item in preview)
+        if request.method == 'POST' and not is_protected:
+            try:
+                self.delete_object(obj, preview)
+                return redirect(self.revers_list_url())
+            except (ProtectedError, RestrictedError) as e:
+                preview = self.get_protected_error_preview(e)
+                is_protected = True
+        return render(request, 'stark/delete.html', {"cancel": self.revers_list_url(),
+                                                     "obj": obj,
+                                                     "preview": preview,
+                                                     "is_protected": is_protected, })
+
+    #-----------------------------------------------------------------#
+
+
+
+
+    ############################## JSON接口 ###########################
+
+    has_api = False  # 是否生成JSON接口的url，默认不生成，可在子类中自行定制
+
+    def get_api_row(self, row, column_plan):
+        """
+        将一行数据转换为字典，只包含字段列和choice列，自定义显示函数返回的是HTML，不包含在内
+        :param row:
+        :param column_plan:
+        :return:
+        """
+        data = {"pk": row.pk}
+        for column in column_plan:
+            if column.kind == 'func':
+                continue
+            if column.kind == 'many':
+                value = [str(item) for item in getattr(row, self.get_many_accessor(column.key)).all()]
+            else:
+                value = column.accessor(row)
+                if isinstance(value, models.Model):
+                    value = str(value)
+            data[column.key] = value
+        return data
+
+    def get_api_data(self, request):
+        """
+        获取新增、修改接口提交的数据，支持JSON和表单两种格式
+        :param request:
+        :return:
+        """
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                data = None
+            return data if isinstance(data, dict) else None
+        return request.POST
+
+    def get_api_form_data(self, form):
+        """
+        获取ModelForm中每个字段的当前值，关联对象转换为主键
+        :param form:
+        :return:
+        """
+        data = {"pk": form.instance.pk}
+        for name, value in form.initial.items():
+            if isinstance(value, models.Model):
+                value = value.pk
+            elif isinstance(value, (list, tuple)):
+                value = [item.pk if isinstance(item, models.Model) else item for item in value]
+            data[name] = value
+        return data
+
+    def api_changelist_view(self, request, *args, **kwargs):
+        """
+        列表JSON接口，参数与列表页面相同（page或cursor、q、组合筛选），不渲染模板
+        :param request:
+        :return:
+        """
+        changelist = self.get_changelist(request, *args, **kwargs)
+        for task in changelist["task_list"]:
+            task()
+        column_plan = [column for column in changelist["column_plan"] if column.kind != 'func']
+        return JsonResponse({
+            "columns": [{"key": column.key, "header": str(column.header)} for column in column_plan],
+            "results": [self.get_api_row(row, column_plan) for row in changelist["data_list"]],
+            "pagination": changelist["pagination"].as_dict(),
+            "search_group": [row.as_dict() for row in changelist["search_group_row_list"]],
+        })
+
+    def api_add_view(self, request, *args, **kwargs):
+        """
+        新增JSON接口，POST提交数据，成功返回201和新数据的主键，验证失败返回400和错误信息
+        :param request:
+        :return:
+        """
+        if request.method != 'POST':
+            return JsonResponse({"error": "请使用POST提交数据"}, status=405)
+        if not self.has_add_btn:
+            return JsonResponse({"error": "没有添加数据的权限"}, status=403)
+        data = self.get_api_data(request)
+        if data is None:
+            return JsonResponse({"error": "数据格式错误"}, status=400)
+        form = self.get_model_form_class()(data=data)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+        self.save(form, is_update=False)
+        return JsonResponse({"pk": form.instance.pk}, status=201)
+
+    def api_change_view(self, request, pk, *args, **kwargs):
+        """
+        修改JSON接口，GET获取数据的当前值，POST提交修改，验证失败返回400和错误信息；
+        设置了version_field时提交GET返回的_version，数据已被他人修改时返回409
+        :param request:
+        :param pk:
+        :return:
+        """
+        obj = self.model_class.objects.filter(pk=pk).first()
+        if not obj:
+            return JsonResponse({"error": "要修改的数据不存在"}, status=404)
+        model_form_class = self.get_model_form_class()
+        if request.method != 'POST':
+            data = self.get_api_form_data(model_form_class(instance=obj))
+            if self.version_field:
+                data["_version"] = self.get_version_value(obj)
+            return JsonResponse(data)
+        data = self.get_api_data(request)
+        if data is None:
+            return JsonResponse({"error": "数据格式错误"}, status=400)
+        form = model_form_class(data=data, instance=obj)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+        self.save(form, is_update=True)
+        if form.errors:
+            return JsonResponse({"errors": form.errors.get_json_data()}, status=409)
+        return JsonResponse({"pk": form.instance.pk})
+
+    def api_delete_view(self, request, pk, *args, **kwargs):
+        """
+        删除JSON接口，POST提交删除；有关联数据阻止删除时返回409和阻止删除的关联表
+        :param request:
+        :param pk:
+        :return:
+        """
+        if request.method != 'POST':
+            return JsonResponse({"error": "请使用POST提交删除"}, status=405)
+        obj = self.model_class.objects.filter(pk=pk).first()
+        if not obj:
+            return JsonResponse({"error": "要删除的数据不存在"}, status=404)
+        preview = self.get_delete_preview(obj)
+        pk = obj.pk
+        if not any(item["action"] == 'protect' for item in preview):
+            try:
+                self.delete_object(obj, preview)
+                return JsonResponse({"pk": pk})
+            except (ProtectedError, RestrictedError) as e:
+                preview = self.get_protected_error_preview(e)
+        protected = [{"model": str(item["verbose_name"]), "count": item["count"]}
+                     for item in preview if item["action"] == 'protect']
+        return JsonResponse({"error": "存在关联数据，不能删除", "protected": protected}, status=409)
 
     #-----------------------------------------------------------------#
 
 
 
 
+
     ############################ url别名操作 #########################
 
     def get_url_name(self, param):
@@ -585,6 +3079,78 @@ class StarkHandler(object):
         """
         return self.get_url_name('delete')
 
+    @property
+    def get_job_url_name(self):
+        """
+        获取到后台任务进度页面的url的name别名
+        :return:
+        """
+        return self.get_url_name('job')
+
+    @property
+    def get_search_group_url_name(self):
+        """
+        获取到加载更多筛选项的url的name别名
+        :return:
+        """
+        return self.get_url_name('search_group')
+
+    @property
+    def get_export_url_name(self):
+        """
+        获取到导出的url的name别名
+        :return:
+        """
+        return self.get_url_name('export')
+
+    @property
+    def get_import_url_name(self):
+        """
+        获取到导入页面的url的name别名
+        :return:
+        """
+        return self.get_url_name('import')
+
+    @property
+    def get_autocomplete_url_name(self):
+        """
+        获取到自动补全加载选项的url的name别名
+        :return:
+        """
+        return self.get_url_name('autocomplete')
+
+    @property
+    def get_api_list_url_name(self):
+        """
+        获取到列表JSON接口的url的name别名
+        :return:
+        """
+        return self.get_url_name('api_list')
+
+    @property
+    def get_api_add_url_name(self):
+        """
+        获取到新增JSON接口的url的name别名
+        :return:
+        """
+        return self.get_url_name('api_add')
+
+    @property
+    def get_api_change_url_name(self):
+        """
+        获取到修改JSON接口的url的name别名
+        :return:
+        """
+        return self.get_url_name('api_change')
+
+    @property
+    def get_api_delete_url_name(self):
+        """
+        获取到删除JSON接口的url的name别名
+        :return:
+        """
+        return self.get_url_name('api_delete')
+
     #-----------------------------------------------------------------#
 
 
@@ -592,6 +3158,38 @@ class StarkHandler(object):
 
 
     ###################### 用于处理携带参数的url #########################
+    url_pk_placeholder = '2718281828459045'  # 生成url模板时代替主键的占位值，需能匹配url中主键的正则
+
+    def get_filter_suffix(self):
+        """
+        将当前请求的参数包装成_filter参数，每个请求只编码一次
+        :return: 例：?_filter=page%3D2，没有请求时为空字符串
+        """
+        request = self.request
+        if not request:
+            return ''
+        url_cache = request.__dict__.setdefault('_stark_url_cache', {})
+        if '_filter' not in url_cache:
+            new_query_dict = QueryDict(mutable=True)
+            new_query_dict['_filter'] = request.GET.urlencode()
+            url_cache['_filter'] = "?%s" % new_query_dict.urlencode()
+        return url_cache['_filter']
+
+    def get_url_template(self, url_name):
+        """
+        获取带主键参数的url模板，每个请求只反向解析一次，生成每行数据的链接时只需拼接主键
+        :param url_name:
+        :return: (主键前的部分, 主键后的部分（含_filter参数）)
+        """
+        request = self.request
+        url_cache = request.__dict__.setdefault('_stark_url_cache', {}) if request else {}
+        name = '%s:%s' % (self.site.namespace, url_name)
+        if name not in url_cache:
+            base_url = reverse(name, args=(self.url_pk_placeholder,))
+            prefix, _, suffix = base_url.rpartition(self.url_pk_placeholder)
+            url_cache[name] = (prefix, suffix + self.get_filter_suffix())
+        return url_cache[name]
+
     def reverse_url(self, url_name, obj_id):
         """
         将原带参数的url中的参数包装给_filter参数，以便在返回页面时能够不丢失原来url的参数
@@ -599,19 +3197,15 @@ class StarkHandler(object):
         :param obj_id:
         :return:
         """
+        if obj_id and len(obj_id) == 1:
+            prefix, suffix = self.get_url_template(url_name)
+            return "%s%s%s" % (prefix, obj_id[0], suffix)
         name = '%s:%s' % (self.site.namespace, url_name)
         if obj_id:
             base_url = reverse(name, args=obj_id)
         else:
             base_url = reverse(name)
-        if not self.request:
-            all_url = base_url
-        else:
-            param = self.request.GET.urlencode()
-            new_query_dict = QueryDict(mutable=True)
-            new_query_dict['_filter'] = param
-            all_url = "%s?%s" % (base_url, new_query_dict.urlencode())
-        return all_url
+        return base_url + self.get_filter_suffix()
 
     def revers_list_url(self):
         """
@@ -634,29 +3228,77 @@ class StarkHandler(object):
 
     def wrapper(self, func):
         """
-        闭包函数，用于在每次生成增删改查url时将每个视图函数的request复制给self.request
+        闭包函数，用于在每次生成增删改查url时将每个视图函数的request复制给self.request，
+        请求结束后恢复，self.request保存在contextvars中，并发的请求互不影响
         :param func: 视图函数
         :return:
         """
         @functools.wraps(func)
         def inner(request, *args, **kwargs):
-            self.request = request
-            return func(request, *args, **kwargs)
+            token = _request_context.set(request)
+            try:
+                return func(request, *args, **kwargs)
+            finally:
+                _request_context.reset(token)
+
+        return inner
+
+    def async_wrapper(self, func):
+        """
+        异步视图的闭包函数，作用同wrapper
+        :param func: 异步视图函数
+        :return:
+        """
+        @functools.wraps(func)
+        async def inner(request, *args, **kwargs):
+            token = _request_context.set(request)
+            try:
+                return await func(request, *args, **kwargs)
+            finally:
+                _request_context.reset(token)
 
         return inner
 
     def get_urls(self):
         """
-        生成四个增删改查url
+        生成四个增删改查url，site.use_async为True时增删改查和导出使用异步视图
         :return:
         """
+        if self.site.use_async:
+            crud_views = [self.async_wrapper(self.async_changelist_view), self.async_wrapper(self.async_add_view),
+                          self.async_wrapper(self.async_change_view), self.async_wrapper(self.async_delete_view)]
+        else:
+            crud_views = [self.wrapper(self.changelist_view), self.wrapper(self.add_view),
+                          self.wrapper(self.change_view), self.wrapper(self.delete_view)]
 
         patterns = [
-            url(r'list/$', self.wrapper(self.changelist_view), name=self.get_list_url_name),
-            url(r'add/$', self.wrapper(self.add_view), name=self.get_add_url_name),
-            url(r'change/(?P<pk>\d+)/$', self.wrapper(self.change_view), name=self.get_change_url_name),
-            url(r'delete/(?P<pk>\d+)/$', self.wrapper(self.delete_view), name=self.get_delete_url_name),
+            url(r'list/$', crud_views[0], name=self.get_list_url_name),
+            url(r'add/$', crud_views[1], name=self.get_add_url_name),
+            url(r'change/(?P<pk>\d+)/$', crud_views[2], name=self.get_change_url_name),
+            url(r'delete/(?P<pk>\d+)/$', crud_views[3], name=self.get_delete_url_name),
+            url(r'job/(?P<pk>\d+)/$', self.wrapper(self.job_view), name=self.get_job_url_name),
+            url(r'search_group/(?P<field>\w+)/$', self.wrapper(self.search_group_view),
+                name=self.get_search_group_url_name),
+            url(r'autocomplete/(?P<field>\w+)/$', self.wrapper(self.autocomplete_view),
+                name=self.get_autocomplete_url_name),
         ]
+        if self.has_export_btn:
+            if self.site.use_async:
+                export_view = self.async_wrapper(self.async_export_view)
+            else:
+                export_view = self.wrapper(self.export_view)
+            patterns.append(url(r'export/$', export_view, name=self.get_export_url_name))
+        if self.has_import_btn:
+            patterns.append(url(r'import/$', self.wrapper(self.import_view), name=self.get_import_url_name))
+        if self.has_api:
+            patterns.extend([
+                url(r'api/list/$', self.wrapper(self.api_changelist_view), name=self.get_api_list_url_name),
+                url(r'api/add/$', self.wrapper(self.api_add_view), name=self.get_api_add_url_name),
+                url(r'api/change/(?P<pk>\d+)/$', self.wrapper(self.api_change_view),
+                    name=self.get_api_change_url_name),
+                url(r'api/delete/(?P<pk>\d+)/$', self.wrapper(self.api_delete_view),
+                    name=self.get_api_delete_url_name),
+            ])
         patterns.extend(self.extra_urls())
         return patterns
 
@@ -672,10 +3314,15 @@ class StarkHandler(object):
 
 class StarkSite(object):
 
-    def __init__(self):
+    def __init__(self, use_async=False):
+        """
+
+        :param use_async: 是否使用异步视图，ASGI部署时可设置为True，例：site.use_async = True（需在生成url之前设置）
+        """
         self._registry = []
         self.app_name = 'stark'
         self.namespace = 'stark'
+        self.use_async = use_async
 
     def register(self, model_class, handler_class=None, prev=None):
         """
@@ -706,6 +3353,16 @@ class StarkSite(object):
                 patterns.append(url(r'%s/%s/' % (app_label, model_name), (handler.get_urls(), None, None)))
         return patterns
 
+    def get_handler(self, model_class):
+        """
+        获取数据表注册的handler，注册了多个时优先返回没有url前缀的
+        :param model_class:
+        :return: 没有注册时返回None
+        """
+        handler_list = [item for item in self._registry if item["model_class"] is model_class]
+        handler_list.sort(key=lambda item: bool(item["prev"]))
+        return handler_list[0]["handler"] if handler_list else None
+
     @property
     def urls(self):
         return self.get_urls(), self.app_name, self.namespace
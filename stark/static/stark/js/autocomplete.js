@@ -0,0 +1,46 @@
+// 关联表数据很多时的自动补全下拉框：输入关键字后分页加载选项，已选中的选项始终保留
+(function ($) {
+    function load(select, reset) {
+        var state = select.data('autocomplete');
+        var params = {term: state.input.val()};
+        if (!reset && state.after) {
+            params.after = state.after;
+        }
+        $.getJSON(select.data('autocomplete-url'), params, function (data) {
+            if (reset) {
+                select.find('option').not(':selected').filter(function () {
+                    return this.value !== '';
+                }).remove();
+            }
+            $.each(data.results, function (index, item) {
+                if (!select.find('option').filter(function () {
+                    return this.value === String(item.id);
+                }).length) {
+                    $('<option>').val(item.id).text(item.text).appendTo(select);
+                }
+            });
+            state.after = data.after;
+            state.more.toggle(data.more);
+        });
+    }
+
+    $(function () {
+        $('select.stark-autocomplete').each(function () {
+            var select = $(this);
+            var timer = null;
+            var input = $('<input type="text" class="form-control" placeholder="输入关键字搜索">').insertBefore(select);
+            var more = $('<a href="javascript:void(0);">更多</a>').hide().insertAfter(select);
+            select.data('autocomplete', {input: input, more: more, after: null});
+            input.on('keyup', function () {
+                clearTimeout(timer);
+                timer = setTimeout(function () {
+                    load(select, true);
+                }, 300);
+            });
+            more.on('click', function () {
+                load(select, false);
+            });
+            load(select, true);
+        });
+    });
+})(jQuery);
@@ -0,0 +1,67 @@
+"""
+批量操作组件
+按主键分块处理数据，每块在单独的事务中执行，避免一个大事务长时间锁表。
+注意：若开启了ATOMIC_REQUESTS，整个请求处于同一个事务中，分块的事务会退化为保存点，锁会持有到请求结束。
+"""
+from django.db import transaction
+
+from stark.utils.cache import bump_model_version
+
+
+def iter_pk_chunks(queryset, chunk_size=1000, start_pk=None):
+    """
+    按主键升序分块获取queryset中数据的主键，每次只查询一块，已处理的数据被删除或修改后也不会影响后续分块
+    :param queryset:
+    :param chunk_size: 每块的数据条数
+    :param start_pk: 从大于该主键的数据开始，用于断点续做
+    :return:
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = start_pk
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pk_list = list(chunk_queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pk_list:
+            break
+        yield pk_list
+        if len(pk_list) < chunk_size:
+            break
+        last_pk = pk_list[-1]
+
+
+def bulk_delete(queryset, chunk_size=1000):
+    """
+    分块删除queryset中的全部数据
+    :param queryset:
+    :param chunk_size: 每个事务删除的数据条数
+    :return: 删除的数据条数（不含级联删除的关联数据）
+    """
+    manager = queryset.model._default_manager
+    count = 0
+    for pk_list in iter_pk_chunks(queryset, chunk_size):
+        with transaction.atomic(using=queryset.db):
+            manager.using(queryset.db).filter(pk__in=pk_list).delete()
+        bump_model_version(queryset.model)
+        count += len(pk_list)
+    return count
+
+
+def bulk_update(queryset, chunk_size=1000, on_chunk=None, **values):
+    """
+    分块修改queryset中的全部数据
+    :param queryset:
+    :param chunk_size: 每个事务修改的数据条数
+    :param on_chunk: 每块修改完成后调用的函数，参数为该块的主键列表，例如用于更新搜索索引
+    :param values: 要修改的字段和值，同queryset.update()
+    :return: 修改的数据条数
+    """
+    manager = queryset.model._default_manager
+    count = 0
+    for pk_list in iter_pk_chunks(queryset, chunk_size):
+        with transaction.atomic(using=queryset.db):
+            count += manager.using(queryset.db).filter(pk__in=pk_list).update(**values)
+        # update()不会触发post_save信号，需手动使缓存失效
+        bump_model_version(queryset.model)
+        if on_chunk:
+            on_chunk(pk_list)
+    return count
@@ -0,0 +1,100 @@
+"""
+缓存组件
+每张数据表在django缓存中维护一个版本号，表数据新增、修改、删除时版本号加一。
+缓存的key中带上版本号，数据变化后版本号改变，旧的缓存自然失效，无需逐个删除。
+注意：多进程部署时需要将django的缓存配置为redis、memcached等共享缓存，否则各进程的版本号互不相通。
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+
+def get_model_label(model_class):
+    """
+    获取数据表的唯一标识，例：app01.userinfo
+    :param model_class:
+    :return:
+    """
+    return '%s.%s' % (model_class._meta.app_label, model_class._meta.model_name)
+
+
+def get_model_version(model_class):
+    """
+    获取数据表当前的版本号
+    :param model_class:
+    :return:
+    """
+    key = 'stark:version:%s' % get_model_label(model_class)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_model_version(model_class):
+    """
+    数据表版本号加一，使该表相关的缓存全部失效。
+    queryset.update()、bulk_create()等批量操作不会触发信号，执行后需要手动调用此方法。
+    :param model_class:
+    :return:
+    """
+    key = 'stark:version:%s' % get_model_label(model_class)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, None)
+
+
+def _bump_model_version_receiver(sender, **kwargs):
+    bump_model_version(sender)
+
+
+def _bump_m2m_version_receiver(sender, instance, action, model, **kwargs):
+    """
+    多对多关联变化时不会触发两侧数据表的post_save，将两侧数据表的版本号都加一
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    bump_model_version(type(instance))
+    bump_model_version(model)
+
+
+_watched_label_set = set()
+
+
+def watch_model(model_class):
+    """
+    监听数据表的post_save、post_delete以及多对多字段的m2m_changed信号，数据变化时自动将版本号加一，重复调用只会连接一次，
+    可以在每次请求时调用
+    :param model_class:
+    :return:
+    """
+    label = get_model_label(model_class)
+    if label in _watched_label_set:
+        return
+    _watched_label_set.add(label)
+    dispatch_uid = 'stark_version_%s' % label
+    post_save.connect(_bump_model_version_receiver, sender=model_class, dispatch_uid=dispatch_uid)
+    post_delete.connect(_bump_model_version_receiver, sender=model_class, dispatch_uid=dispatch_uid)
+    # 正向、反向多对多字段的增删通过中间表的m2m_changed信号通知
+    through_list = [field.remote_field.through for field in model_class._meta.many_to_many]
+    through_list.extend(rel.through for rel in model_class._meta.related_objects if rel.many_to_many)
+    for through in through_list:
+        m2m_changed.connect(_bump_m2m_version_receiver, sender=through,
+                            dispatch_uid='stark_m2m_version_%s' % get_model_label(through))
+
+
+def make_cache_key(prefix, model_class, condition=None):
+    """
+    生成带数据表版本号的缓存key
+    :param prefix: key前缀，用于区分不同用途的缓存，例：count
+    :param model_class: 数据表模型类
+    :param condition: 影响缓存内容的条件，需可被json序列化
+    :return:
+    """
+    data = json.dumps(condition, sort_keys=True, default=str)
+    digest = hashlib.md5(data.encode('utf-8')).hexdigest()
+    return 'stark:%s:%s:%s:%s' % (prefix, get_model_label(model_class), get_model_version(model_class), digest)
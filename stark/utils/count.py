@@ -0,0 +1,45 @@
+"""
+数据总条数估算组件
+"""
+from django.db import connections, DatabaseError
+
+
+def estimate_count(model_class, using='default'):
+    """
+    根据数据库的统计信息估算表的总行数，不执行COUNT，速度与表大小无关。
+    统计信息由数据库的ANALYZE维护，可能与实际行数有偏差。
+    支持SQLite（需执行过ANALYZE，读取sqlite_stat1）、PostgreSQL（pg_class.reltuples）、MySQL（information_schema）。
+    :param model_class: 数据表模型类
+    :param using: 数据库别名
+    :return: 估算的行数，无法估算时返回None
+    """
+    connection = connections[using]
+    table = model_class._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if not cursor.fetchone():
+                    return None
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                row = cursor.fetchone()
+                if row and row[0]:
+                    row = (row[0].split()[0],)
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)",
+                               [connection.ops.quote_name(table)])
+                row = cursor.fetchone()
+            elif connection.vendor == 'mysql':
+                cursor.execute("SELECT table_rows FROM information_schema.tables "
+                               "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+                row = cursor.fetchone()
+            else:
+                return None
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    count = int(float(row[0]))
+    if count < 0:
+        return None
+    return count
@@ -0,0 +1,228 @@
+"""
+后台任务组件
+将耗时较长的批量操作提交到线程池中执行，请求立即返回任务id；任务的状态、进度和断点保存在stark_job表中，
+页面通过轮询任务状态url获取进度，并可随时取消。
+线程池大小可在settings中通过STARK_JOB_WORKERS配置，默认为4。
+任务函数只保存在执行它的进程内存中，进程退出后任务不会继续执行：每个任务记录所属进程，
+本进程线程池中仍在排队或执行的任务不会被判定为失败；其他进程的任务超过STARK_JOB_STALE_TIMEOUT秒（默认600）
+没有更新进度、且该进程已没有在更新进度的任务时，会被标记为执行失败，断点只用于记录失败时已处理到的位置。
+"""
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from stark.utils.bulk import iter_pk_chunks
+
+_executor = None
+_executor_lock = threading.Lock()
+_process_id = None
+_pending_job_set = set()
+_pending_job_lock = threading.Lock()
+
+
+def get_process_id():
+    """
+    获取当前进程的标识，记录在任务上用于判断任务是否属于本进程；
+    fork出的子进程pid不同，会重新生成标识
+    :return:
+    """
+    global _process_id
+    pid = os.getpid()
+    if _process_id is None or _process_id[0] != pid:
+        _process_id = (pid, '%s-%s-%s' % (socket.gethostname()[:40], pid, uuid.uuid4().hex[:8]))
+    return _process_id[1]
+
+
+def get_pending_jobs():
+    """
+    本进程线程池中仍在排队或执行的任务id
+    :return:
+    """
+    with _pending_job_lock:
+        return set(_pending_job_set)
+
+
+def get_executor():
+    """
+    获取执行后台任务的线程池，第一次使用时创建
+    :return:
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            fail_orphaned_jobs()
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'STARK_JOB_WORKERS', 4),
+                                           thread_name_prefix='stark-job')
+    return _executor
+
+
+def fail_orphaned_jobs():
+    """
+    将所属进程已经退出（重启、崩溃）的等待执行、执行中的任务标记为执行失败，否则状态会一直停留在执行中：
+    本进程的任务只要还在线程池中就不处理；其他进程的任务超过STARK_JOB_STALE_TIMEOUT秒没有更新进度时，
+    执行中的任务直接标记为失败，等待执行的任务在该进程已没有在更新进度的任务时才标记为失败（排队时间不算超时）
+    :return:
+    """
+    from stark.models import Job
+
+    now = timezone.now()
+    stale_time = now - timedelta(seconds=getattr(settings, 'STARK_JOB_STALE_TIMEOUT', 600))
+    stale_list = list(Job.objects.filter(status__in=[1, 2], update_time__lt=stale_time))
+    if not stale_list:
+        return
+    process_id = get_process_id()
+    pending_job_set = get_pending_jobs()
+    alive_owner_set = set(Job.objects.filter(status=2, update_time__gte=stale_time).values_list('owner', flat=True))
+    for job in stale_list:
+        if job.owner == process_id:
+            if job.pk in pending_job_set:
+                continue
+        elif job.status == 1 and job.owner in alive_owner_set:
+            continue
+        message = '任务所在的进程已退出，任务未执行完成'
+        if job.checkpoint:
+            message = '%s，已处理到：%s' % (message, job.checkpoint)
+        Job.objects.filter(pk=job.pk, status=job.status, update_time=job.update_time).update(
+            status=4, message=message, update_time=now)
+
+
+class JobCancelled(Exception):
+    """
+    任务被取消时由JobContext抛出，任务执行器捕获后将任务标记为已取消
+    """
+    pass
+
+
+class JobContext(object):
+    """
+    传给后台批量操作函数的任务对象，用于上报进度、记录断点（已处理到的位置）以及检查任务是否被取消
+    """
+
+    def __init__(self, job):
+        """
+        :param job: Job表的数据对象
+        """
+        self.job = job
+
+    @property
+    def checkpoint(self):
+        """
+        上一次记录的断点
+        :return:
+        """
+        return self.job.checkpoint
+
+    def set_total(self, total):
+        """
+        设置需要处理的总条数，用于页面显示进度
+        :param total:
+        :return:
+        """
+        self.job.total = total
+        self.save_progress()
+
+    def update(self, step=0, checkpoint=None, message=None):
+        """
+        上报进度，同时检查任务是否被取消，被取消时抛出JobCancelled
+        :param step: 本次新处理的条数
+        :param checkpoint: 断点，一般为已处理的最后一条数据的主键
+        :param message: 执行信息
+        :return:
+        """
+        self.job.progress += step
+        if checkpoint is not None:
+            self.job.checkpoint = str(checkpoint)
+        if message is not None:
+            self.job.message = message
+        self.save_progress()
+
+    def save_progress(self):
+        """
+        保存进度，任务已被请求取消时不再保存并抛出JobCancelled
+        :return:
+        """
+        from stark.models import Job
+
+        updated = Job.objects.filter(pk=self.job.pk, is_cancelled=False).update(
+            progress=self.job.progress,
+            total=self.job.total,
+            checkpoint=self.job.checkpoint,
+            message=self.job.message,
+            update_time=timezone.now(),
+        )
+        if not updated:
+            raise JobCancelled()
+
+    def iter_chunks(self, queryset, chunk_size=1000):
+        """
+        按主键分块遍历queryset，每处理完一块自动记录断点和进度，任务被取消时停止
+        例：
+            for pk_list in job.iter_chunks(queryset):
+                self.model_class.objects.filter(pk__in=pk_list).update(status=2)
+        :param queryset:
+        :param chunk_size: 每块的数据条数
+        :return:
+        """
+        if self.job.total is None:
+            self.set_total(queryset.count())
+        for pk_list in iter_pk_chunks(queryset, chunk_size):
+            yield pk_list
+            self.update(step=len(pk_list), checkpoint=pk_list[-1])
+
+
+def run_job(job_pk, func, *args, **kwargs):
+    """
+    在线程池中执行任务，并根据执行结果更新任务状态
+    :param job_pk: 任务id
+    :param func: 任务函数，第一个参数为JobContext对象
+    :return:
+    """
+    from stark.models import Job
+
+    try:
+        # 开始执行时刷新更新时间，排队等待的时间不计入执行中任务的超时
+        if not Job.objects.filter(pk=job_pk, status=1, is_cancelled=False).update(status=2,
+                                                                                   update_time=timezone.now()):
+            Job.objects.filter(pk=job_pk, status=1).update(status=5)
+            return
+        context = JobContext(Job.objects.get(pk=job_pk))
+        try:
+            func(context, *args, **kwargs)
+        except JobCancelled:
+            Job.objects.filter(pk=job_pk).update(status=5, update_time=timezone.now())
+        except Exception as e:
+            Job.objects.filter(pk=job_pk).update(status=4, message=str(e), update_time=timezone.now())
+        else:
+            Job.objects.filter(pk=job_pk).update(status=3, update_time=timezone.now())
+    finally:
+        with _pending_job_lock:
+            _pending_job_set.discard(job_pk)
+        connections.close_all()
+
+
+def submit_job(name, handler, func, *args, **kwargs):
+    """
+    创建任务并在当前事务提交后提交到线程池中执行
+    :param name: 任务名称
+    :param handler: 任务所属的列表页面标识
+    :param func: 任务函数，第一个参数为JobContext对象
+    :return: Job表的数据对象
+    """
+    from stark.models import Job
+
+    job = Job.objects.create(name=name, handler=handler, owner=get_process_id())
+
+    def submit():
+        with _pending_job_lock:
+            _pending_job_set.add(job.pk)
+        get_executor().submit(run_job, job.pk, func, *args, **kwargs)
+
+    transaction.on_commit(submit)
+    return job
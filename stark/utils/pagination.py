@@ -1,18 +1,40 @@
 """
 分页组件
 """
+import base64
+import datetime
+import itertools
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, F
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    游标的JSON编码器，DjangoJSONEncoder会把datetime、time截断到毫秒，
+    游标中的值必须与数据库中的值完全一致，否则会跳过或重复微秒级不同的数据，因此保留完整精度
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
 
 
 class Pagination(object):
-    def __init__(self, current_page, all_count, base_url, query_params, per_page=20, pager_page_count=11):
+    def __init__(self, current_page, all_count, base_url, query_params, per_page=20, pager_page_count=11,
+                 is_estimated=False):
         """
         分页初始化
         :param current_page: 当前页码
         :param per_page: 每页显示数据条数
-        :param all_count: 数据库中总条数
+        :param all_count: 数据库中总条数，为None时不统计总数，只根据是否存在下一页生成页码
         :param base_url: 基础URL
         :param query_params: QueryDict对象，内部含所有当前URL的原条件
         :param pager_page_count: 页面上最多显示的页码数量
+        :param is_estimated: 总条数是否为根据数据库统计信息得到的估算值
         """
         self.base_url = base_url
         try:
@@ -23,16 +45,32 @@ class Pagination(object):
             self.current_page = 1
         self.query_params = query_params
         self.per_page = per_page
-        self.all_count = all_count
         self.pager_page_count = pager_page_count
-        pager_count, b = divmod(all_count, per_page)
-        if b != 0:
-            pager_count += 1
-        self.pager_count = pager_count
+        self.has_next = False
+        self.set_all_count(all_count, is_estimated)
 
         half_pager_page_count = int(pager_page_count / 2)
         self.half_pager_page_count = half_pager_page_count
 
+    def set_all_count(self, all_count, is_estimated=False):
+        """
+        设置数据总条数，总条数可以在截取当前页数据之后再设置，以便两条查询并发执行
+        :param all_count: 数据库中总条数，为None时不统计总数
+        :param is_estimated: 总条数是否为估算值
+        :return:
+        """
+        self.all_count = all_count
+        self.is_estimated = is_estimated
+        if all_count is None:
+            self.pager_count = None
+            return
+        pager_count, b = divmod(all_count, self.per_page)
+        if b != 0:
+            pager_count += 1
+        self.pager_count = pager_count
+        if not is_estimated:
+            self.has_next = self.current_page < self.pager_count
+
     @property
     def start(self):
         """
@@ -49,15 +87,93 @@ class Pagination(object):
         """
         return self.current_page * self.per_page
 
+    def slice_queryset(self, queryset):
+        """
+        按当前页码截取数据，总条数未知或为估算值时多取一条，用于判断是否存在下一页
+        :param queryset:
+        :return:
+        """
+        if self.all_count is not None and not self.is_estimated:
+            return queryset[self.start:self.end]
+        data_list = list(queryset[self.start:self.end + 1])
+        self.has_next = len(data_list) > self.per_page
+        return data_list[:self.per_page]
+
+    def iter_chunks(self, queryset, chunk_size=200, use_iterator=True):
+        """
+        按当前页码分块获取数据，不一次性加载整页，总条数未知或为估算值时多取一条用于判断是否存在下一页，
+        遍历结束后has_next才准确
+        :param queryset:
+        :param chunk_size: 每块的数据条数
+        :param use_iterator: 是否使用queryset.iterator()在一条查询中流式读取，为False时每块单独查询（用于prefetch_related）
+        :return:
+        """
+        fetch_extra = self.all_count is None or self.is_estimated
+        stop = self.end + 1 if fetch_extra else self.end
+        if fetch_extra:
+            self.has_next = False
+
+        def iter_source():
+            if use_iterator:
+                iterator = queryset[self.start:stop].iterator(chunk_size=chunk_size)
+                while True:
+                    chunk = list(itertools.islice(iterator, chunk_size))
+                    if not chunk:
+                        return
+                    yield chunk
+            else:
+                for offset in range(self.start, stop, chunk_size):
+                    chunk = list(queryset[offset:min(offset + chunk_size, stop)])
+                    if not chunk:
+                        return
+                    yield chunk
+                    if len(chunk) < chunk_size:
+                        return
+
+        remaining = self.per_page
+        for chunk in iter_source():
+            if len(chunk) > remaining:
+                self.has_next = True
+                chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            if chunk:
+                yield chunk
+
+    def get_pager_count(self):
+        """
+        获取生成页码时使用的总页数，总条数未知或为估算值时结合是否存在下一页进行修正
+        :return:
+        """
+        if self.pager_count is not None and not self.is_estimated:
+            return self.pager_count
+        known_pager_count = self.current_page + 1 if self.has_next else self.current_page
+        if self.pager_count is None or not self.has_next:
+            return known_pager_count
+        return max(self.pager_count, known_pager_count)
+
+    def as_dict(self):
+        """
+        分页信息，用于JSON接口
+        :return:
+        """
+        return {"page": self.current_page,
+                "per_page": self.per_page,
+                "count": self.all_count,
+                "is_estimated": self.is_estimated,
+                "page_count": self.get_pager_count(),
+                "has_prev": self.current_page > 1,
+                "has_next": self.has_next, }
+
     def page_html(self):
         """
         生成HTML页码
         :return:
         """
+        pager_count = self.get_pager_count()
         # 如果数据总页码pager_count<11 pager_page_count
-        if self.pager_count < self.pager_page_count:
+        if pager_count < self.pager_page_count:
             pager_start = 1
-            pager_end = self.pager_count
+            pager_end = pager_count
         else:
             # 数据页码已经超过11
             # 判断： 如果当前页 <= 5 half_pager_page_count
@@ -66,9 +182,9 @@ class Pagination(object):
                 pager_end = self.pager_page_count
             else:
                 # 如果： 当前页+5 > 总页码
-                if (self.current_page + self.half_pager_page_count) > self.pager_count:
-                    pager_end = self.pager_count
-                    pager_start = self.pager_count - self.pager_page_count + 1
+                if (self.current_page + self.half_pager_page_count) > pager_count:
+                    pager_end = pager_count
+                    pager_start = pager_count - self.pager_page_count + 1
                 else:
                     pager_start = self.current_page - self.half_pager_page_count
                     pager_end = self.current_page + self.half_pager_page_count
@@ -90,11 +206,258 @@ class Pagination(object):
                 tpl = '<li><a href="%s?%s">%s</a></li>' % (self.base_url, self.query_params.urlencode(), i,)
             page_list.append(tpl)
 
-        if self.current_page >= self.pager_count:
+        if not self.has_next:
             nex = '<li><a href="#">下一页</a></li>'
         else:
             self.query_params['page'] = self.current_page + 1
             nex = '<li><a href="%s?%s">下一页</a></li>' % (self.base_url, self.query_params.urlencode(),)
         page_list.append(nex)
+        if self.is_estimated:
+            page_list.append('<li class="disabled"><span>约%s条</span></li>' % self.all_count)
         page_str = "".join(page_list)
         return page_str
+
+
+class CursorPagination(object):
+    """
+    游标（keyset）分页组件，按上一页最后一条数据的排序字段值定位下一页，不使用OFFSET，
+    因此翻到任意深度的页面耗时都与第一页相同，适用于数据量很大的表。
+    排序字段的值为NULL时，NULL视为比其他值都大：升序时排在最后，降序时排在最前。
+    """
+
+    def __init__(self, cursor, order_list, base_url, query_params, per_page=20, cursor_param='cursor',
+                 model_class=None):
+        """
+        分页初始化
+        :param cursor: url中携带的游标字符串，为空时显示第一页
+        :param order_list: 排序字段列表，最后一个字段必须唯一（一般为主键），例：['-id']、['name', 'id']
+        :param base_url: 基础URL
+        :param query_params: QueryDict对象，内部含所有当前URL的原条件
+        :param per_page: 每页显示数据条数
+        :param cursor_param: url中游标参数的名称
+        :param model_class: 数据的模型类，用于按排序字段的类型校验游标中的值
+        """
+        self.order_list = order_list
+        self.model_class = model_class
+        self.base_url = base_url
+        self.query_params = query_params
+        self.per_page = per_page
+        self.cursor_param = cursor_param
+        self.values, self.is_backward = self.decode_cursor(cursor)
+
+        self.has_prev = False
+        self.has_next = False
+        self.prev_cursor = None
+        self.next_cursor = None
+
+    @staticmethod
+    def encode_cursor(values, is_backward=False):
+        """
+        将排序字段的值编码为url安全的游标字符串
+        :param values: 排序字段的值列表
+        :param is_backward: 是否为向前翻页的游标
+        :return:
+        """
+        data = json.dumps({"v": values, "b": is_backward}, cls=CursorJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        解析游标字符串，游标不合法时按第一页处理
+        :param cursor:
+        :return: (排序字段的值列表, 是否向前翻页)
+        """
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+            values = data["v"]
+            if not isinstance(values, list) or len(values) != len(self.order_list):
+                raise ValueError()
+            values = [self.clean_value(item, value) for item, value in zip(self.order_list, values)]
+            return values, bool(data.get("b"))
+        except (ValueError, TypeError, KeyError, ValidationError):
+            return None, False
+
+    def get_field(self, name):
+        """
+        获取排序字段对应的模型字段，支持跨表字段，例：depart__title；annotate等非模型字段返回None
+        :param name:
+        :return:
+        """
+        if self.model_class is None:
+            return None
+        opts = self.model_class._meta
+        field = None
+        for part in name.split('__'):
+            if opts is None:
+                return None
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                return None
+            opts = field.related_model._meta if field.related_model else None
+        return field
+
+    def clean_value(self, item, value):
+        """
+        按排序字段的类型转换游标中的值，值不合法时抛出ValueError或ValidationError
+        :param item: 排序字段，例：'-id'
+        :param value: 游标中的值
+        :return:
+        """
+        if value is None:
+            return None
+        field = self.get_field(item.lstrip('-'))
+        if field is None or not hasattr(field, 'to_python'):
+            return value
+        return field.to_python(value)
+
+    @staticmethod
+    def get_order_value(obj, name):
+        """
+        获取数据对象上排序字段的值，支持跨表字段，例：depart__title
+        :param obj:
+        :param name:
+        :return:
+        """
+        parts = name.split('__')
+        for part in parts[:-1]:
+            obj = getattr(obj, part)
+            if obj is None:
+                return None
+        try:
+            field = obj._meta.get_field(parts[-1])
+        except (FieldDoesNotExist, AttributeError):
+            return getattr(obj, parts[-1])
+        return getattr(obj, getattr(field, 'attname', parts[-1]))
+
+    def get_order_list(self):
+        """
+        获取本次查询实际使用的排序，向前翻页时将排序方向反转
+        :return:
+        """
+        if not self.is_backward:
+            return self.order_list
+        return [item[1:] if item.startswith('-') else '-%s' % item for item in self.order_list]
+
+    def get_order_by(self):
+        """
+        生成order_by的排序表达式，NULL升序时排在最后，降序时排在最前，与get_condition的比较方式一致
+        :return:
+        """
+        order_by = []
+        for item in self.get_order_list():
+            if item.startswith('-'):
+                order_by.append(F(item[1:]).desc(nulls_first=True))
+            else:
+                order_by.append(F(item).asc(nulls_last=True))
+        return order_by
+
+    @staticmethod
+    def get_equal_condition(name, value):
+        """
+        排序字段等于游标中的值的条件，值为None时使用__isnull
+        :param name:
+        :param value:
+        :return:
+        """
+        if value is None:
+            return Q(**{"%s__isnull" % name: True})
+        return Q(**{name: value})
+
+    @staticmethod
+    def get_after_condition(item, value):
+        """
+        按排序方向排在游标中的值之后的条件，NULL视为最大值；没有数据能排在其后时返回None
+        :param item: 排序字段，例：'-id'
+        :param value:
+        :return:
+        """
+        name = item.lstrip('-')
+        if item.startswith('-'):
+            if value is None:
+                return Q(**{"%s__isnull" % name: False})
+            return Q(**{"%s__lt" % name: value})
+        if value is None:
+            return None
+        return Q(**{"%s__gt" % name: value}) | Q(**{"%s__isnull" % name: True})
+
+    def get_condition(self):
+        """
+        根据游标生成定位条件，例：排序为 ['name', 'id'] 时生成 name > v1 OR (name = v1 AND id > v2)
+        :return:
+        """
+        conn = Q()
+        conn.connector = 'OR'
+        for index, item in enumerate(self.get_order_list()):
+            condition = self.get_after_condition(item, self.values[index])
+            if condition is None:
+                continue
+            for prev_index in range(index):
+                condition &= self.get_equal_condition(self.order_list[prev_index].lstrip('-'), self.values[prev_index])
+            conn.children.append(condition)
+        return conn
+
+    def slice_queryset(self, queryset):
+        """
+        按游标截取当前页数据，多取一条用于判断是否还有下一页（向前翻页时判断是否还有上一页）
+        :param queryset:
+        :return:
+        """
+        queryset = queryset.order_by(*self.get_order_by())
+        if self.values is not None:
+            condition = self.get_condition()
+            queryset = queryset.filter(condition) if condition.children else queryset.none()
+        data_list = list(queryset[:self.per_page + 1])
+        has_more = len(data_list) > self.per_page
+        data_list = data_list[:self.per_page]
+
+        if self.is_backward:
+            data_list.reverse()
+            self.has_prev = has_more
+            self.has_next = True
+        else:
+            self.has_prev = self.values is not None
+            self.has_next = has_more
+
+        if data_list:
+            names = [item.lstrip('-') for item in self.order_list]
+            self.prev_cursor = self.encode_cursor([self.get_order_value(data_list[0], name) for name in names], True)
+            self.next_cursor = self.encode_cursor([self.get_order_value(data_list[-1], name) for name in names])
+        return data_list
+
+    def as_dict(self):
+        """
+        分页信息，用于JSON接口，翻页时将cursor参数设置为prev_cursor或next_cursor
+        :return:
+        """
+        return {"per_page": self.per_page,
+                "cursor_param": self.cursor_param,
+                "has_prev": self.has_prev,
+                "has_next": self.has_next,
+                "prev_cursor": self.prev_cursor if self.has_prev else None,
+                "next_cursor": self.next_cursor if self.has_next else None, }
+
+    def page_html(self):
+        """
+        生成HTML页码，只有首页、上一页、下一页
+        :return:
+        """
+        page_list = []
+        self.query_params.pop('page', None)
+
+        if self.has_prev and self.prev_cursor:
+            self.query_params.pop(self.cursor_param, None)
+            page_list.append('<li><a href="%s?%s">首页</a></li>' % (self.base_url, self.query_params.urlencode()))
+            self.query_params[self.cursor_param] = self.prev_cursor
+            page_list.append('<li><a href="%s?%s">上一页</a></li>' % (self.base_url, self.query_params.urlencode()))
+        else:
+            page_list.append('<li><a href="#">上一页</a></li>')
+
+        if self.has_next and self.next_cursor:
+            self.query_params[self.cursor_param] = self.next_cursor
+            page_list.append('<li><a href="%s?%s">下一页</a></li>' % (self.base_url, self.query_params.urlencode()))
+        else:
+            page_list.append('<li><a href="#">下一页</a></li>')
+        return "".join(page_list)
@@ -0,0 +1,274 @@
+"""
+列表页面搜索后端
+StarkHandler通过search_backend_class指定搜索后端，默认的SearchBackend将关键字按search_list生成OR条件（LIKE查询）。
+SqliteFTSSearchBackend为每张表维护一张SQLite FTS5全文索引表，通过信号增量更新，搜索时按相关度排序。
+"""
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+
+
+class SearchBackend(object):
+    """
+    搜索后端基类，将搜索框的关键字按search_list生成OR条件的Q对象
+    """
+
+    def __init__(self, handler):
+        """
+        :param handler: StarkHandler对象
+        """
+        self.handler = handler
+        self.model_class = handler.model_class
+
+    def install(self):
+        """
+        注册时调用，用于连接维护索引的信号等
+        :return:
+        """
+        pass
+
+    def filter(self, queryset, search_value):
+        """
+        按关键字过滤queryset
+        :param queryset: 已排序的queryset
+        :param search_value: 搜索框的关键字
+        :return:
+        """
+        conn = Q()
+        conn.connector = 'OR'
+        for item in self.handler.get_search_list():
+            conn.children.append((item, search_value))
+        return queryset.filter(conn)
+
+    def index(self, obj_list, using=DEFAULT_DB_ALIAS):
+        """
+        更新数据的索引，用于bulk_create等不触发post_save信号的批量写入之后，默认没有索引，不处理
+        :param obj_list: 新增或修改的数据对象列表
+        :param using: 数据库别名
+        :return:
+        """
+        pass
+
+    def index_pk_list(self, pk_list, using=DEFAULT_DB_ALIAS):
+        """
+        按主键更新数据的索引，用于queryset.update()等只知道主键的批量修改之后，默认没有索引，不处理
+        :param pk_list: 修改的数据的主键列表
+        :param using: 数据库别名
+        :return:
+        """
+        pass
+
+    def order(self, queryset, search_value):
+        """
+        按相关度排序，用于筛选已放在子查询中的外层queryset（有数据库计算列时），默认不排序
+        :param queryset: 已排序的queryset
+        :param search_value: 搜索框的关键字
+        :return:
+        """
+        return queryset
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        """
+        重建索引
+        :param using: 数据库别名
+        :return: 写入索引的数据条数，没有索引时返回None
+        """
+        return None
+
+
+class SqliteFTSSearchBackend(SearchBackend):
+    """
+    基于SQLite FTS5（trigram分词，支持中文和任意子串匹配）的全文索引搜索后端。
+    索引search_list中本表的字段，例：search_list = ['name__contains', 'email__contains'] 索引name、email两列；
+    跨表字段无法增量维护，不参与索引。
+    首次使用前需执行 python manage.py stark_rebuild_search 建立索引，之后通过post_save、post_delete信号增量更新；
+    stark的导入、行内编辑、update_queryset等批量写入通过index()、index_pk_list()更新索引；自行执行queryset.update()、bulk_create()等不触发信号的批量操作后需要重新执行该命令。
+    以下情况自动退回LIKE查询：数据库不是SQLite、索引表尚未建立、关键字中有少于3个字符的词（trigram分词的限制）。
+    """
+    min_term_length = 3
+
+    def __init__(self, handler):
+        super(SqliteFTSSearchBackend, self).__init__(handler)
+        meta = self.model_class._meta
+        self.table = 'stark_fts_%s_%s' % (meta.app_label, meta.model_name)
+        self.field_list = []
+        for item in handler.get_search_list():
+            field = meta.get_field(item.split('__')[0])
+            if field.concrete and not field.is_relation and field not in self.field_list:
+                self.field_list.append(field)
+        self.ready_alias_set = set()
+
+    def is_ready(self, using):
+        """
+        索引表是否可用：数据库为SQLite、主键为整数、且索引表已经建立
+        :param using: 数据库别名
+        :return:
+        """
+        if using in self.ready_alias_set:
+            return True
+        connection = connections[using]
+        if connection.vendor != 'sqlite' or not self.field_list:
+            return False
+        if self.model_class._meta.pk.get_internal_type() not in ('AutoField', 'BigAutoField', 'IntegerField',
+                                                                 'BigIntegerField', 'SmallAutoField'):
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            if not cursor.fetchone():
+                return False
+        self.ready_alias_set.add(using)
+        return True
+
+    def install(self):
+        dispatch_uid = 'stark_fts_%s' % self.table
+        post_save.connect(self.on_save, sender=self.model_class, dispatch_uid=dispatch_uid)
+        post_delete.connect(self.on_delete, sender=self.model_class, dispatch_uid=dispatch_uid)
+
+    def get_row(self, instance):
+        """
+        获取一条数据写入索引表的值
+        :param instance:
+        :return:
+        """
+        row = [instance.pk]
+        for field in self.field_list:
+            value = getattr(instance, field.attname)
+            row.append('' if value is None else str(value))
+        return row
+
+    def get_insert_sql(self, connection):
+        qn = connection.ops.quote_name
+        return "INSERT OR REPLACE INTO %s (rowid, %s) VALUES (%s)" % (
+            qn(self.table), ', '.join(qn(field.column) for field in self.field_list),
+            ', '.join(['%s'] * (len(self.field_list) + 1)))
+
+    def get_value_rows(self, queryset):
+        """
+        按queryset从数据库读取写入索引表的值，每次读取2000条
+        :param queryset:
+        :return:
+        """
+        value_list = queryset.values_list('pk', *[field.attname for field in self.field_list])
+        for row in value_list.iterator(chunk_size=2000):
+            yield [row[0]] + ['' if value is None else str(value) for value in row[1:]]
+
+    def index(self, obj_list, using=DEFAULT_DB_ALIAS):
+        if not obj_list or not self.is_ready(using):
+            return
+        connection = connections[using]
+        insert_sql = self.get_insert_sql(connection)
+        row_list = [self.get_row(instance) for instance in obj_list if instance.pk is not None]
+        with connection.cursor() as cursor:
+            if row_list:
+                cursor.executemany(insert_sql, row_list)
+            if len(row_list) == len(obj_list):
+                return
+            # 数据库不支持bulk_create返回主键时，补上索引中最大rowid之后新增的数据
+            cursor.execute("SELECT rowid FROM %s ORDER BY rowid DESC LIMIT 1" % connection.ops.quote_name(self.table))
+            last_row = cursor.fetchone()
+            queryset = self.model_class._default_manager.using(using)
+            if last_row:
+                queryset = queryset.filter(pk__gt=last_row[0])
+            batch = []
+            for row in self.get_value_rows(queryset):
+                batch.append(row)
+                if len(batch) >= 2000:
+                    cursor.executemany(insert_sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(insert_sql, batch)
+
+    def index_pk_list(self, pk_list, using=DEFAULT_DB_ALIAS):
+        if not pk_list or not self.is_ready(using):
+            return
+        connection = connections[using]
+        queryset = self.model_class._default_manager.using(using).filter(pk__in=pk_list)
+        with connection.cursor() as cursor:
+            cursor.executemany(self.get_insert_sql(connection), list(self.get_value_rows(queryset)))
+
+    def on_save(self, sender, instance, update_fields=None, using=DEFAULT_DB_ALIAS, **kwargs):
+        if update_fields is not None and not {field.name for field in self.field_list} & set(update_fields):
+            return
+        if not self.is_ready(using):
+            return
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.execute(self.get_insert_sql(connection), self.get_row(instance))
+
+    def on_delete(self, sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+        if not self.is_ready(using):
+            return
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % connection.ops.quote_name(self.table), [instance.pk])
+
+    def get_match(self, queryset, search_value):
+        """
+        生成FTS5的MATCH表达式，需要退回LIKE查询时返回None
+        :param queryset:
+        :param search_value:
+        :return:
+        """
+        term_list = search_value.split()
+        if not term_list or any(len(term) < self.min_term_length for term in term_list):
+            return None
+        if not self.is_ready(queryset.db):
+            return None
+        return ' '.join('"%s"' % term.replace('"', '""') for term in term_list)
+
+    def apply_match(self, queryset, match):
+        """
+        联接索引表，按MATCH过滤并查询相关度search_rank，排序时search_rank优先
+        :param queryset:
+        :param match:
+        :return:
+        """
+        qn = connections[queryset.db].ops.quote_name
+        order_list = queryset.query.order_by
+        queryset = queryset.extra(
+            select={"search_rank": "%s.rank" % qn(self.table)},
+            tables=[self.table],
+            where=["%s.rowid = %s.%s" % (qn(self.table), qn(self.model_class._meta.db_table),
+                                         qn(self.model_class._meta.pk.column)),
+                   "%s MATCH %%s" % qn(self.table)],
+            params=[match],
+        )
+        return queryset.order_by('search_rank', *order_list)
+
+    def filter(self, queryset, search_value):
+        match = self.get_match(queryset, search_value)
+        if match is None:
+            return super(SqliteFTSSearchBackend, self).filter(queryset, search_value)
+        return self.apply_match(queryset, match)
+
+    def order(self, queryset, search_value):
+        match = self.get_match(queryset, search_value)
+        if match is None:
+            return queryset
+        # 索引表按rowid与本表一对一联接，不会使计算列的统计结果成倍增加
+        return self.apply_match(queryset, match)
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        connection = connections[using]
+        if connection.vendor != 'sqlite' or not self.field_list:
+            return None
+        qn = connection.ops.quote_name
+        count = 0
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS %s" % qn(self.table))
+                cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, tokenize='trigram')" % (
+                    qn(self.table), ', '.join(qn(field.column) for field in self.field_list)))
+                insert_sql = self.get_insert_sql(connection)
+                batch = []
+                for row in self.get_value_rows(self.model_class._default_manager.using(using)):
+                    batch.append(row)
+                    if len(batch) >= 2000:
+                        cursor.executemany(insert_sql, batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    cursor.executemany(insert_sql, batch)
+                    count += len(batch)
+        self.ready_alias_set.discard(using)
+        return count
@@ -0,0 +1,77 @@
+"""
+自动补全插件
+关联表数据很多时，下拉框不再一次性渲染关联表的全部数据，只渲染已选中的选项，
+其余选项在输入关键字时通过ajax分页加载。
+"""
+from django import forms
+from django.core.exceptions import ValidationError
+
+
+class AutocompleteMixin(object):
+    """
+    只渲染已选中选项的下拉框，url为加载选项的地址，返回格式：
+    {"results": [{"id": 值, "text": 文本}, ...], "more": 是否还有更多, "after": 下一页的起始位置}
+    """
+
+    def __init__(self, url, attrs=None, choices=()):
+        self.url = url
+        self.object_dict = None  # 已查询出的已选中数据{值: 数据}，设置后渲染时不再查询，例如行内编辑时整页共用一次查询
+        super(AutocompleteMixin, self).__init__(attrs, choices)
+
+    class Media:
+        js = ['stark/js/autocomplete.js']
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super(AutocompleteMixin, self).build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = self.url
+        attrs['class'] = ('%s stark-autocomplete' % attrs.get('class', '')).strip()
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        只查询已选中的值对应的数据，而不是遍历关联表的全部数据
+        :param name:
+        :param value: 已选中的值列表
+        :param attrs:
+        :return:
+        """
+        selected = [item for item in value if item not in (None, '')]
+        groups = []
+        index = 0
+        if not self.allow_multiple_selected and not self.is_required:
+            groups.append((None, [self.create_option(name, '', '---------', not selected, index, attrs=attrs)], index))
+            index += 1
+        if not selected:
+            return groups
+
+        field = self.choices.field
+        key = field.to_field_name or 'pk'
+        meta = self.choices.queryset.model._meta
+        model_field = meta.get_field(field.to_field_name) if field.to_field_name else meta.pk
+        value_list = []
+        for item in selected:
+            try:
+                value_list.append(model_field.to_python(item))
+            except (ValueError, TypeError, ValidationError):
+                # 提交了不合法的值，表单验证会给出错误提示，这里跳过即可
+                continue
+        if not value_list:
+            return groups
+        if self.object_dict is not None:
+            obj_list = [self.object_dict[str(item)] for item in value_list if str(item) in self.object_dict]
+        else:
+            obj_list = self.choices.queryset.filter(**{'%s__in' % key: value_list})
+        for obj in obj_list:
+            option = self.create_option(name, field.prepare_value(obj), field.label_from_instance(obj), True, index,
+                                        attrs=attrs)
+            groups.append((None, [option], index))
+            index += 1
+        return groups
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    """ForeignKey字段的自动补全下拉框"""
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    """ManyToManyField字段的自动补全多选下拉框"""